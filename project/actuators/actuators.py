@@ -2,6 +2,10 @@ import json
 import os
 import requests
 import paho.mqtt.client as mqtt
+from common.rec_config import ConfigWatcher
+from common.profiling import start_profiling_server
+from common.communities import (DEFAULT_REC, community_subscriptions, discover_communities,
+                                namespaced_route, split_topic)
 
 # MQTT parameters and sensors API configuration using environment variables
 BROKER = os.getenv("BROKER", "broker")
@@ -17,11 +21,11 @@ class APIManager:
         # Removes any trailing slashes to avoid duplications
         self.base_url = base_url.rstrip('/')
 
-    def activate_consumer(self, member_id, consumer):
+    def activate_consumer(self, member_id, consumer, rec_id: str = DEFAULT_REC):
         """
-        Sends an activation request to the /activate endpoint.
+        Sends an activation request to the /activate endpoint of the community.
         """
-        url = f"{self.base_url}/activate"
+        url = f"{self.base_url}{namespaced_route('/activate', rec_id)}"
         print(
             f"INFO: Sending activation request to {url} with consumer_id {consumer} and member_id {member_id}",
             flush=True,
@@ -34,14 +38,19 @@ class Actuator:
     Represents an actuator capable of executing commands,
     for example, activating a device via an API.
     """
-    def __init__(self, sensors_api: APIManager = None) -> None:
+    def __init__(self, sensors_api: APIManager = None, config_watcher: ConfigWatcher = None,
+                 rec_id: str = DEFAULT_REC) -> None:
         self.api_manager = sensors_api
+        self.config_watcher = config_watcher
+        self.rec_id = rec_id
 
     def activate(self, member_id, consumer) -> None:
-        print(f"INFO: Activating consumer {consumer} of member {member_id}", flush=True)
-        if self.api_manager:
+        print(f"INFO: Activating consumer {consumer} of member {member_id} of community {self.rec_id}", flush=True)
+        if self.config_watcher is not None and not self.config_watcher.compiled.has_consumer(member_id, consumer):
+            print(f"ERROR: Consumer {consumer} of member {member_id} is not in the REC configuration", flush=True)
+        elif self.api_manager:
             try:
-                response = self.api_manager.activate_consumer(member_id, consumer)
+                response = self.api_manager.activate_consumer(member_id, consumer, self.rec_id)
                 if response.status_code == 200:
                     print(
                         f"INFO: Successfully sent activation to sensors API: {member_id} {consumer}",
@@ -63,13 +72,13 @@ class Actuator:
 class MQTTManager:
     """
     Manages the MQTT connection, message reception, and distribution
-    of commands to the actuator.
+    of commands to the actuator of their community.
     """
-    def __init__(self, broker: str, port: int, topic: str, actuator: Actuator) -> None:
+    def __init__(self, broker: str, port: int, topic: str, actuators: dict) -> None:
         self.broker = broker
         self.port = port
         self.topic = topic
-        self.actuator = actuator
+        self.actuators = actuators
 
         self.client = mqtt.Client(client_id="consumer", clean_session=False)
         self.client.on_connect = self.on_connect
@@ -79,7 +88,7 @@ class MQTTManager:
     def on_connect(self, client, userdata, flags, rc) -> None:
         if rc == 0:
             print(f"INFO: Connected to MQTT broker {self.broker}:{self.port}", flush=True)
-            client.subscribe(self.topic, qos=1)
+            client.subscribe([(topic, 1) for topic in community_subscriptions(self.topic)])
         else:
             print(f"ERROR: Connection failed with result code {rc}", flush=True)
 
@@ -107,8 +116,13 @@ class MQTTManager:
             if not all([member_id, consumer_id, action]):
                 raise ValueError("Missing required fields in payload")
 
+            rec_id, _ = split_topic(message.topic)
+            actuator = self.actuators.get(rec_id)
+            if actuator is None:
+                raise ValueError(f"Unknown community {rec_id}")
+
             # Executes the command via the actuator
-            self.actuator.activate(member_id, consumer_id)
+            actuator.activate(member_id, consumer_id)
 
         except json.JSONDecodeError:
             print("ERROR: Received invalid JSON payload", flush=True)
@@ -129,8 +143,13 @@ class MQTTManager:
 
 def main() -> None:
     sensors_api = APIManager(SENSORS_API)
-    actuator = Actuator(sensors_api)
-    publisher = MQTTManager(BROKER, PORT, MQTT_TOPIC, actuator)
+    actuators = {}
+    for rec_id, config_path in discover_communities().items():
+        config_watcher = ConfigWatcher(config_path)
+        config_watcher.start()
+        actuators[rec_id] = Actuator(sensors_api, config_watcher, rec_id)
+    start_profiling_server()
+    publisher = MQTTManager(BROKER, PORT, MQTT_TOPIC, actuators)
 
     try:
         publisher.connect()
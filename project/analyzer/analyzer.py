@@ -1,11 +1,18 @@
-import json
 import time
 import os
+import queue
+import threading
 import pandas as pd
 import requests
 import warnings
+import paho.mqtt.client as mqtt
 from influxdb_client import InfluxDBClient
 from influxdb_client.client.warnings import MissingPivotFunction
+from common.rec_config import ConfigWatcher, CompiledREC, ConfigDelta
+from common.profiling import hot_path, start_profiling_server
+from common.communities import (DEFAULT_REC, FairScheduler, community_subscriptions, discover_communities,
+                                namespaced_route, split_topic)
+from common.run_export import RunExporter, create_exporter
 
 # Suppress specific InfluxDB warnings
 warnings.simplefilter("ignore", MissingPivotFunction)
@@ -16,9 +23,36 @@ TOKEN = os.getenv('INFLUXDB_TOKEN')
 ORG = os.getenv('INFLUXDB_ORG')
 URL = os.getenv('INFLUXDB_URL')
 PLANNER_API = os.getenv('PLANNER_API')
-IS_URGENT_THRESHOLD = int(os.getenv('IS_URGENT_THRESHOLD'))
+# Requests to the planner do not block the shared worker pool for long: a community whose
+# snapshot was not accepted runs its next cycle after a backoff doubling from
+# PLANNER_RETRY_DELAY up to PLANNER_MAX_RETRY_DELAY seconds
+PLANNER_TIMEOUT = float(os.getenv('PLANNER_TIMEOUT', 2))
+PLANNER_RETRY_DELAY = float(os.getenv('PLANNER_RETRY_DELAY', 1))
+PLANNER_MAX_RETRY_DELAY = float(os.getenv('PLANNER_MAX_RETRY_DELAY', 30))
+IS_URGENT_THRESHOLD = int(os.getenv('IS_URGENT_THRESHOLD', 30))
 SIMULATION_STEP = int(os.getenv('SIMULATION_STEP', 1))
 
+# Adaptive scheduling of the analyzer cycles
+ADAPTIVE_SCHEDULING = os.getenv('ADAPTIVE_SCHEDULING', 'True').lower() in ('true', '1', 'yes')
+MIN_SIMULATION_STEP = float(os.getenv('MIN_SIMULATION_STEP', 0.5))
+MAX_SIMULATION_STEP = float(os.getenv('MAX_SIMULATION_STEP', 30))
+# Seconds for a state change published on MQTT to be queryable in InfluxDB (Telegraf flush
+# interval plus margin): a cycle woken by the event is followed by one after this delay
+INGEST_DELAY = float(os.getenv('INGEST_DELAY', 2))
+# Simulated minutes (unit of tau and delta) elapsing per wall-clock second
+SIMULATION_SPEED = float(os.getenv('SIMULATION_SPEED', 1))
+BROKER = os.getenv('BROKER', 'broker')
+PORT = int(os.getenv('PORT', 1883))
+TAUDELTA_TOPIC = "/consumer/taudelta/+/+"
+
+# Table of the columnar run export (RUN_EXPORT_DIR): one row per pending consumer and cycle.
+# snapshot_id identifies the snapshot sent to the planner, whose decisions carry the same id.
+EXPORT_SCHEMAS = {
+    "analyzer_decisions": [("snapshot_id", "int64"), ("member_id", "string"), ("consumer_id", "string"),
+                           ("tau", "float64"), ("delta", "float64"), ("cons_required", "float64"),
+                           ("battery", "float64"), ("activable", "bool"), ("urgent", "bool")],
+}
+
 
 class DBManager:
     """
@@ -53,14 +87,24 @@ class DBManager:
                 else:
                     raise
 
-    def get_battery_level(self) -> float:
+    @staticmethod
+    def community_filter(rec_id: str) -> str:
+        """
+        Flux filter selecting the series of a community (the default community has no rec_id tag).
+        """
+        if rec_id == DEFAULT_REC:
+            return 'filter(fn: (r) => not exists r["rec_id"])'
+        return f'filter(fn: (r) => r["rec_id"] == "{rec_id}")'
+
+    def get_battery_level(self, rec_id: str = DEFAULT_REC) -> float:
         """
-        Retrieves the current battery level from InfluxDB.
+        Retrieves the current battery level of a community from InfluxDB.
         """
         query_str = f"""
             from(bucket: "{self.bucket}")
                 |> range(start: -30s)
                 |> filter(fn: (r) => r["_measurement"] == "battery")
+                |> {self.community_filter(rec_id)}
                 |> last()
                 |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
         """
@@ -68,14 +112,15 @@ class DBManager:
         # Assumes the battery level is in the column "value"
         return df["value"].values[0]
 
-    def update_tau_delta(self, consumers: dict) -> dict:
+    def update_tau_delta(self, consumers: dict, rec_id: str = DEFAULT_REC) -> dict:
         """
-        Updates tau, delta, and active status for each consumer by querying InfluxDB.
+        Updates tau, delta, and active status for each consumer of a community by querying InfluxDB.
         """
         query_str = f"""
             from(bucket: "{self.bucket}")
                 |> range(start: -30s)
                 |> filter(fn: (r) => r["_measurement"] == "tau_delta")
+                |> {self.community_filter(rec_id)}
                 |> last()
         """
         query_result = self.query(query_str)
@@ -93,7 +138,8 @@ class DBManager:
                     consumers[member_id][consumer_id]["active"] = value
         return consumers
 
-    def calculate_cons_required(self, consumers: dict) -> dict:
+    @staticmethod
+    def calculate_cons_required(consumers: dict) -> dict:
         """
         Calculates the required consumption for each consumer based on tau and the consumption rate.
         """
@@ -103,22 +149,39 @@ class DBManager:
                 consumers[member][consumer]["cons_required"] = (consumers[member][consumer]["tau"] / 60) * consumers[member][consumer]["cons"]
         return consumers
 
-    def load_sensor_config(self) -> dict:
+    @staticmethod
+    def new_consumer_state(cons: float) -> dict:
         """
-        Loads the sensor configuration from the REC.json file and initializes values.
+        Returns the initial state of a consumer as tracked by the analyzer.
         """
-        with open('config/REC.json', 'r') as file:
-            config = json.load(file)
+        return {"cons": cons, "tau": 0, "delta": 0, "active": False, "cons_required": 0}
 
-        consumers = {}
+    def load_sensor_config(self, compiled: CompiledREC) -> dict:
+        """
+        Builds the consumers state from the compiled REC configuration and initializes values.
+        """
+        consumers = {member_id: {} for member_id in compiled.member_ids}
         # Initialize tau, delta, active and cons_required for each consumer
-        for member in config["members"]:
-            for consumer_id in config["members"][member]["consumers"]:
-                config["members"][member]["consumers"][consumer_id]["tau"] = 0
-                config["members"][member]["consumers"][consumer_id]["delta"] = 0
-                config["members"][member]["consumers"][consumer_id]["active"] = False
-                config["members"][member]["consumers"][consumer_id]["cons_required"] = 0
-            consumers[member] = config["members"][member]["consumers"]
+        for member_id, consumer_id, cons in compiled.iter_consumers():
+            consumers[member_id][consumer_id] = self.new_consumer_state(cons)
+        return consumers
+
+    def apply_config_delta(self, consumers: dict, delta: ConfigDelta) -> dict:
+        """
+        Adds, removes or updates members and consumers while keeping the state (tau, delta, activation)
+        of the existing ones.
+        """
+        for member_id in delta.added_members:
+            consumers[member_id] = {}
+        for member_id, consumer_id, cons in delta.added_consumers:
+            consumers[member_id][consumer_id] = self.new_consumer_state(cons)
+        for member_id, consumer_id, _ in delta.removed_consumers:
+            consumers.get(member_id, {}).pop(consumer_id, None)
+        for member_id, consumer_id, cons in delta.changed_consumers:
+            if consumer_id in consumers.get(member_id, {}):
+                consumers[member_id][consumer_id]["cons"] = cons
+        for member_id in delta.removed_members:
+            consumers.pop(member_id, None)
         return consumers
 
 
@@ -129,6 +192,7 @@ class Analyzer:
     def __init__(self, is_urgent_threshold: int):
         self.is_urgent_threshold = is_urgent_threshold
 
+    @hot_path
     def get_activable_consumers(self, consumers: dict, battery_level: float) -> dict:
         """
         Determines which consumers can be activated based on their tau, delta,
@@ -172,37 +236,317 @@ class Analyzer:
         print(df.to_string(index=False), flush=True)
 
 
+
+class AdaptiveScheduler:
+    """
+    Computes when the next analyzer cycle is needed instead of running at a fixed step.
+    The next wake-up is the nearest of:
+      - the moment a pending consumer's slack (delta - tau) crosses the urgency threshold,
+      - the moment the battery, at its recent rate of change, covers a pending consumer,
+    bounded by [min_interval, max_interval]. State-change events wake the loop early, and
+    again ingest_delay seconds later, once the change is surely readable from the database.
+    """
+    def __init__(self, is_urgent_threshold: int, fixed_interval: float, min_interval: float,
+                 max_interval: float, simulation_speed: float, ingest_delay: float = 0):
+        self.is_urgent_threshold = is_urgent_threshold
+        self.fixed_interval = fixed_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.simulation_speed = simulation_speed
+        self.ingest_delay = ingest_delay
+        self.wake_event = threading.Event()
+        # Time of the last state-change event
+        self.last_event = None
+        self.battery_rate = 0
+        self.last_battery = None
+        # Statistics compared with the fixed loop
+        self.started_at = None
+        self.cycles = 0
+        self.early_wakeups = 0
+        self.reported_urgent = set()
+        self.max_detection_delay = 0
+
+    def notify(self, event_time: float = None) -> None:
+        """
+        Wakes the analyzer before the scheduled time. event_time is given for state-change
+        events, whose data may not be ingested yet.
+        """
+        if event_time is not None:
+            self.last_event = event_time
+        self.wake_event.set()
+
+    def observe(self, battery_level: float, now: float) -> None:
+        """
+        Records a cycle and updates the smoothed battery rate of change (kWh per second).
+        """
+        if self.started_at is None:
+            self.started_at = now
+        self.cycles += 1
+        if self.last_battery is not None and now > self.last_battery[1]:
+            rate = (battery_level - self.last_battery[0]) / (now - self.last_battery[1])
+            self.battery_rate = 0.7 * self.battery_rate + 0.3 * rate
+        self.last_battery = (battery_level, now)
+
+    def record_detection(self, activable_consumers: dict) -> None:
+        """
+        Measures how late urgent consumers are detected: the slack below the
+        threshold at detection time, converted to wall-clock seconds.
+        """
+        urgent = set()
+        for member, consumers in activable_consumers.items():
+            for consumer in consumers:
+                if consumer["isUrgent"]:
+                    key = (member, consumer["consumer_id"])
+                    urgent.add(key)
+                    if key not in self.reported_urgent:
+                        slack = consumer["delta"] - consumer["tau"]
+                        delay = max(self.is_urgent_threshold - slack, 0) / self.simulation_speed
+                        self.max_detection_delay = max(self.max_detection_delay, delay)
+        self.reported_urgent = urgent
+
+    def next_delay(self, consumers: dict, battery_level: float, activable_consumers: dict) -> float:
+        """
+        Returns the number of seconds until the next cycle is needed.
+        """
+        # Something is activable: keep the regular cadence until the planner acts on it
+        if activable_consumers:
+            return self.fixed_interval
+        delay = self.max_interval
+        min_cons_required = None
+        for member in consumers:
+            for consumer in consumers[member].values():
+                if consumer["active"] or consumer["tau"] <= 0:
+                    continue
+                slack = consumer["delta"] - consumer["tau"]
+                delay = min(delay, (slack - self.is_urgent_threshold) / self.simulation_speed)
+                if consumer["cons_required"] > 0 and (min_cons_required is None or consumer["cons_required"] < min_cons_required):
+                    min_cons_required = consumer["cons_required"]
+        if min_cons_required is not None and self.battery_rate > 0:
+            delay = min(delay, (min_cons_required - battery_level) / self.battery_rate)
+        return max(delay, self.min_interval)
+
+    def follow_up(self, delay: float, cycle_start: float, now: float) -> float:
+        """
+        Shortens the delay so that a cycle runs once the last state change is ingested,
+        when the cycle that started at cycle_start may have read the database before.
+        """
+        if self.last_event is not None and cycle_start < self.last_event + self.ingest_delay:
+            return min(delay, max(self.last_event + self.ingest_delay - now, self.min_interval))
+        return delay
+
+    def wait(self, delay: float) -> None:
+        """
+        Sleeps for the given delay or until a state-change event.
+        """
+        if self.wake_event.wait(delay):
+            self.early_wakeups += 1
+        self.wake_event.clear()
+
+    def report(self, now: float) -> dict:
+        """
+        Query load and worst-case urgency detection delay compared with the fixed loop.
+        Each cycle issues two Flux queries (battery and tau/delta).
+        """
+        elapsed = now - self.started_at if self.started_at is not None else 0
+        fixed_cycles = elapsed / self.fixed_interval
+        return {
+            "cycles": self.cycles,
+            "queries": 2 * self.cycles,
+            "fixed_loop_queries": int(2 * fixed_cycles),
+            "query_reduction": 1 - self.cycles / fixed_cycles if fixed_cycles else 0,
+            "early_wakeups": self.early_wakeups,
+            "max_detection_delay_s": self.max_detection_delay,
+            "fixed_loop_max_detection_delay_s": self.fixed_interval,
+        }
+
+
+class StateChangeListener:
+    """
+    Subscribes to the tau/delta stream of every community and wakes the community's
+    scheduler when one of its consumers gets a new request or changes its activation status.
+    """
+    def __init__(self, broker: str, port: int, topic: str, notify):
+        self.broker = broker
+        self.port = port
+        self.topic = topic
+        self.notify = notify
+        self.states = {}
+        self.client = mqtt.Client(client_id="analyzer")
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+
+    def on_connect(self, client, userdata, flags, rc) -> None:
+        if rc == 0:
+            print(f"INFO: Connected to MQTT broker {self.broker}:{self.port}", flush=True)
+            client.subscribe([(topic, 0) for topic in community_subscriptions(self.topic)])
+        else:
+            print(f"ERROR: Connection failed with result code {rc}", flush=True)
+
+    @staticmethod
+    def parse_tau_delta(payload: str) -> tuple:
+        """
+        Extracts ((member_id, consumer_id), (assigned, active)) from a tau_delta line protocol message.
+        """
+        tags, fields = payload.split(" ")[:2]
+        tags = dict(tag.split("=", 1) for tag in tags.split(",")[1:])
+        fields = dict(field.split("=", 1) for field in fields.split(","))
+        assigned = float(fields["tau"]) > 0
+        active = fields["active"] == "True"
+        return (tags["member_id"], tags["consumer_id"]), (assigned, active)
+
+    def on_message(self, client, userdata, message) -> None:
+        rec_id, _ = split_topic(message.topic)
+        try:
+            key, state = self.parse_tau_delta(message.payload.decode("utf-8"))
+        except (ValueError, KeyError) as e:
+            print(f"ERROR: Invalid tau_delta message: {e}", flush=True)
+            return
+        key = (rec_id,) + key
+        if self.states.get(key) != state:
+            self.states[key] = state
+            self.notify(rec_id)
+
+    def start(self) -> None:
+        try:
+            self.client.connect(self.broker, self.port)
+            self.client.loop_start()
+        except Exception as e:
+            # Without events the scheduler still wakes up on its computed deadlines
+            print(f"ERROR: Failed to connect to MQTT broker: {e}", flush=True)
+
 class APIManager:
     """
     Manages communication with the Planner API.
     """
-    def __init__(self, planner_api: str):
+    def __init__(self, planner_api: str, timeout: float = PLANNER_TIMEOUT):
         self.planner_api = planner_api
+        self.timeout = timeout
 
-    def send_activable_consumers(self, activable_consumers: dict) -> None:
+    def send_activable_consumers(self, activable_consumers: dict, rec_id: str = DEFAULT_REC) -> bool:
         """
-        Sends the activable consumers data to the Planner API.
-        Retries up to 5 times if the request fails.
+        Sends the activable consumers data of a community to the Planner API.
+        Returns False if the planner did not accept it; the caller retries with a newer snapshot.
         """
-        url = f"{self.planner_api}/activable_consumers"
+        url = f"{self.planner_api}{namespaced_route('/activable_consumers', rec_id)}"
         headers = {'Content-Type': 'application/json'}
-        retries = 5
-        for attempt in range(retries):
-            try:
-                response = requests.post(url, headers=headers, json=activable_consumers)
-                if response.status_code == 200:
-                    print("Data successfully sent to the planner API.", flush=True)
-                    break
-                else:
-                    print(f"Failed to send data to the planner API. Status code: {response.status_code}", flush=True)
-                    if attempt < retries - 1:
-                        time.sleep(5)
-            except requests.exceptions.ConnectionError as e:
-                print(f"Attempt {attempt + 1} failed: {e}", flush=True)
-                if attempt < retries - 1:
-                    time.sleep(5)
-                else:
-                    print("Max retries exceeded. Could not connect to the planner API.", flush=True)
+        try:
+            response = requests.post(url, headers=headers, json=activable_consumers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to send data of community {rec_id} to the planner API: {e}", flush=True)
+            return False
+        # The planner accepts the snapshot (202) and plans it asynchronously
+        if response.status_code in (200, 202):
+            print("Data successfully sent to the planner API.", flush=True)
+            return True
+        print(f"Failed to send data of community {rec_id} to the planner API. Status code: {response.status_code}", flush=True)
+        return False
+
+
+class Community:
+    """
+    Isolated analyzer state of a community: its consumers, pending configuration
+    changes and adaptive scheduler. Cycles of different communities run on a shared
+    worker pool; a community never has two cycles running at once.
+    """
+    def __init__(self, rec_id: str, config_watcher: ConfigWatcher, db_manager: DBManager,
+                 analyzer: Analyzer, api_manager: APIManager, on_change=None, exporter: RunExporter = None):
+        self.rec_id = rec_id
+        self.db_manager = db_manager
+        self.analyzer = analyzer
+        self.api_manager = api_manager
+        self.on_change = on_change
+        self.exporter = exporter
+        self.consumers = db_manager.load_sensor_config(config_watcher.compiled)
+        self.scheduler = AdaptiveScheduler(IS_URGENT_THRESHOLD, SIMULATION_STEP, MIN_SIMULATION_STEP,
+                                           MAX_SIMULATION_STEP, SIMULATION_SPEED, INGEST_DELAY)
+        self.due = 0
+        # Consecutive snapshots not accepted by the planner
+        self.send_failures = 0
+        # Configuration changes are queued by the watcher thread and applied between cycles
+        self.pending_config = queue.Queue()
+        config_watcher.add_listener(self.on_config_change)
+
+    def on_config_change(self, compiled: CompiledREC, delta: ConfigDelta) -> None:
+        self.pending_config.put(delta)
+        self.notify()
+
+    def notify(self, event_time: float = None) -> None:
+        self.scheduler.notify(event_time)
+        if self.on_change is not None:
+            self.on_change()
+
+    def export_decisions(self, snapshot_id: int, battery_level: float, activable_consumers: dict) -> None:
+        """
+        Records every pending consumer of the cycle, and whether it was found activable and urgent.
+        """
+        activable = {(member, consumer["consumer_id"]): consumer["isUrgent"]
+                     for member, consumers in activable_consumers.items() for consumer in consumers}
+        for member_id, member_consumers in self.consumers.items():
+            for consumer_id, consumer in member_consumers.items():
+                if consumer["tau"] <= 0 or consumer["active"]:
+                    continue
+                key = (member_id, consumer_id)
+                self.exporter.write("analyzer_decisions", self.rec_id, snapshot_id, snapshot_id=snapshot_id,
+                                    member_id=member_id, consumer_id=consumer_id, tau=consumer["tau"],
+                                    delta=consumer["delta"], cons_required=consumer["cons_required"],
+                                    battery=battery_level, activable=key in activable,
+                                    urgent=activable.get(key, False))
+
+    def retry_delay(self) -> float:
+        return min(PLANNER_RETRY_DELAY * 2 ** (self.send_failures - 1), PLANNER_MAX_RETRY_DELAY)
+
+    def is_due(self, now: float) -> bool:
+        if self.send_failures:
+            # State changes do not cut the backoff short
+            return now >= self.due
+        return now >= self.due or self.scheduler.wake_event.is_set()
+
+    def cycle(self) -> None:
+        now = cycle_start = time.time()
+        if self.scheduler.wake_event.is_set() and now < self.due:
+            self.scheduler.early_wakeups += 1
+        self.scheduler.wake_event.clear()
+        # Not due again until this cycle has computed its next deadline
+        self.due = float("inf")
+        try:
+            while not self.pending_config.empty():
+                self.consumers = self.db_manager.apply_config_delta(self.consumers, self.pending_config.get())
+            battery_level = self.db_manager.get_battery_level(self.rec_id)
+            self.consumers = self.db_manager.update_tau_delta(self.consumers, self.rec_id)
+            self.consumers = self.db_manager.calculate_cons_required(self.consumers)
+            activable_consumers = self.analyzer.get_activable_consumers(self.consumers, battery_level)
+            snapshot_id = time.time_ns()
+            if self.exporter is not None:
+                self.export_decisions(snapshot_id, battery_level, activable_consumers)
+
+            sent = True
+            if activable_consumers:
+                message = {"members": activable_consumers, "battery": battery_level, "snapshot_id": snapshot_id}
+                sent = self.api_manager.send_activable_consumers(message, self.rec_id)
+                self.send_failures = 0 if sent else self.send_failures + 1
+                if self.rec_id != DEFAULT_REC:
+                    print(f"Community {self.rec_id}:", flush=True)
+                self.analyzer.print_activable_consumers_in_table(activable_consumers)
+
+            now = time.time()
+            self.scheduler.observe(battery_level, now)
+            self.scheduler.record_detection(activable_consumers)
+            if self.scheduler.cycles % 100 == 0:
+                print(f"INFO: Scheduler stats of community {self.rec_id}: {self.scheduler.report(now)}", flush=True)
+            if not sent:
+                # Retried by a later cycle (with a fresh snapshot) instead of blocking the worker
+                self.due = now + self.retry_delay()
+            elif ADAPTIVE_SCHEDULING:
+                delay = self.scheduler.next_delay(self.consumers, battery_level, activable_consumers)
+                self.due = now + self.scheduler.follow_up(delay, cycle_start, now)
+            else:
+                self.due = now + SIMULATION_STEP
+        except Exception:
+            self.due = time.time() + SIMULATION_STEP
+            raise
+        finally:
+            if self.on_change is not None:
+                self.on_change()
 
 
 if __name__ == '__main__':
@@ -210,17 +554,32 @@ if __name__ == '__main__':
     analyzer = Analyzer(IS_URGENT_THRESHOLD)
     api_manager = APIManager(PLANNER_API)
 
-    consumers = db_manager.load_sensor_config()
-    print("Starting simulation with simulation step", SIMULATION_STEP, flush=True)
+    # The dispatcher sleeps until the earliest deadline or until a community changes state
+    wake_event = threading.Event()
+    exporter = create_exporter(EXPORT_SCHEMAS)
+    communities = {}
+    for rec_id, config_path in discover_communities().items():
+        config_watcher = ConfigWatcher(config_path)
+        communities[rec_id] = Community(rec_id, config_watcher, db_manager, analyzer, api_manager, wake_event.set,
+                                       exporter)
+        config_watcher.start()
+
+    def on_state_change(rec_id: str) -> None:
+        community = communities.get(rec_id)
+        if community is not None:
+            community.notify(time.time())
+
+    start_profiling_server()
+    if ADAPTIVE_SCHEDULING:
+        StateChangeListener(BROKER, PORT, TAUDELTA_TOPIC, on_state_change).start()
+    print("Starting simulation with simulation step", SIMULATION_STEP,
+          "(adaptive)" if ADAPTIVE_SCHEDULING else "", f"for {len(communities)} communities", flush=True)
     time.sleep(10)
+    pool = FairScheduler()
     while True:
-        battery_level = db_manager.get_battery_level()
-        consumers = db_manager.update_tau_delta(consumers)
-        consumers = db_manager.calculate_cons_required(consumers)
-        activable_consumers = analyzer.get_activable_consumers(consumers, battery_level)
-
-        if activable_consumers:
-            message = {"members": activable_consumers, "battery": battery_level}
-            api_manager.send_activable_consumers(message)
-            analyzer.print_activable_consumers_in_table(activable_consumers)
-        time.sleep(SIMULATION_STEP)
+        now = time.time()
+        pool.submit_round({rec_id: community.cycle for rec_id, community in communities.items()
+                           if community.is_due(now)})
+        next_due = min(community.due for community in communities.values())
+        wake_event.wait(min(max(next_due - time.time(), MIN_SIMULATION_STEP / 10), MAX_SIMULATION_STEP))
+        wake_event.clear()
@@ -0,0 +1,134 @@
+import glob
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Tuple
+
+from common.rec_config import REC_CONFIG_PATH
+
+# The community described by REC.json keeps the original topics, routes and series,
+# so that a single-community deployment is unchanged. Every other community is read
+# from <REC_COMMUNITIES_DIR>/<rec_id>.json and namespaced under /rec/<rec_id>.
+DEFAULT_REC = "default"
+REC_COMMUNITIES_DIR = os.getenv("REC_COMMUNITIES_DIR", os.path.join(os.path.dirname(REC_CONFIG_PATH), "recs"))
+COMMUNITY_WORKERS = int(os.getenv("COMMUNITY_WORKERS", 4))
+TOPIC_PREFIX = "/rec/"
+
+
+def discover_communities(default_path: str = REC_CONFIG_PATH, communities_dir: str = REC_COMMUNITIES_DIR) -> Dict[str, str]:
+    """
+    Returns the configuration file of every community, keyed by rec_id.
+    """
+    communities = {}
+    if os.path.exists(default_path):
+        communities[DEFAULT_REC] = default_path
+    for path in sorted(glob.glob(os.path.join(communities_dir, "*.json"))):
+        rec_id = os.path.splitext(os.path.basename(path))[0]
+        if rec_id == DEFAULT_REC or "/" in rec_id or "+" in rec_id or "#" in rec_id:
+            print(f"WARNING: Ignoring community file with reserved name {path}", flush=True)
+            continue
+        communities[rec_id] = path
+    return communities
+
+
+def namespaced_topic(topic: str, rec_id: str) -> str:
+    """
+    Prefixes a topic with its community (the default community keeps the plain topic).
+    """
+    return topic if rec_id == DEFAULT_REC else f"{TOPIC_PREFIX}{rec_id}{topic}"
+
+
+def split_topic(topic: str) -> Tuple[str, str]:
+    """
+    Returns (rec_id, topic without the community prefix).
+    """
+    if topic.startswith(TOPIC_PREFIX):
+        rec_id, _, rest = topic[len(TOPIC_PREFIX):].partition("/")
+        return rec_id, "/" + rest
+    return DEFAULT_REC, topic
+
+
+def community_subscriptions(topic: str) -> list:
+    """
+    Topic filters matching a topic in every community.
+    """
+    return [topic, f"{TOPIC_PREFIX}+{topic}"]
+
+
+def namespaced_route(path: str, rec_id: str) -> str:
+    return path if rec_id == DEFAULT_REC else f"{TOPIC_PREFIX}{rec_id}{path}"
+
+
+def tag_line(line: str, rec_id: str) -> str:
+    """
+    Adds the rec_id tag to a line protocol record (not for the default community).
+    """
+    if rec_id == DEFAULT_REC:
+        return line
+    series, sep, rest = line.partition(" ")
+    measurement, comma, tags = series.partition(",")
+    return f"{measurement},rec_id={rec_id}{comma}{tags}{sep}{rest}"
+
+
+class FairScheduler:
+    """
+    Runs per-community tasks on a worker pool shared by all communities.
+    Each round submits at most one task per community, starting from a rotating
+    position, and skips communities whose previous task is still running, so that
+    a slow community cannot pile up work or starve the others.
+    """
+    def __init__(self, workers: int = COMMUNITY_WORKERS) -> None:
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.inflight = set()
+        self.order = deque()
+        self.skipped = {}
+
+    def submit_round(self, tasks: Dict[str, Callable[[], None]]) -> list:
+        """
+        Submits the task of every idle community and returns the submitted rec_ids.
+        """
+        with self.lock:
+            for rec_id in tasks:
+                if rec_id not in self.order:
+                    self.order.append(rec_id)
+            self.order.rotate(-1)
+            submitted = []
+            for rec_id in list(self.order):
+                if rec_id not in tasks:
+                    continue
+                if rec_id in self.inflight:
+                    self.skipped[rec_id] = self.skipped.get(rec_id, 0) + 1
+                    continue
+                self.inflight.add(rec_id)
+                submitted.append(rec_id)
+        for rec_id in submitted:
+            self.pool.submit(self._run, rec_id, tasks[rec_id])
+        return submitted
+
+    def _run(self, rec_id: str, task: Callable[[], None]) -> None:
+        try:
+            task()
+        except Exception as e:
+            print(f"ERROR: Task of community {rec_id} failed: {e}", flush=True)
+        finally:
+            with self.lock:
+                self.inflight.discard(rec_id)
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """
+        Waits until no task is running (used by benchmarks and shutdown).
+        """
+        done = threading.Event()
+
+        def check():
+            while True:
+                with self.lock:
+                    if not self.inflight:
+                        done.set()
+                        return
+                if done.wait(0.001):
+                    return
+        threading.Thread(target=check, daemon=True).start()
+        return done.wait(timeout)
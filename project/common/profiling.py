@@ -0,0 +1,300 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from bottle import Bottle, request, response, run
+
+# Port of the profiling server of the services without an HTTP API (analyzer, actuators)
+PROFILING_PORT = int(os.getenv("PROFILING_PORT", 5050))
+SAMPLING_INTERVAL = float(os.getenv("PROFILING_SAMPLING_INTERVAL", 0.005))
+MAX_PROFILING_SECONDS = 600
+
+
+class HotPathCounter:
+    """
+    Number of calls and cumulative time of an instrumented function.
+    """
+    __slots__ = ("calls", "total_ns", "max_ns")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "total_ms": self.total_ns / 1e6,
+            "mean_ms": self.total_ns / self.calls / 1e6 if self.calls else None,
+            "max_ms": self.max_ns / 1e6,
+        }
+
+
+class Profiler:
+    """
+    On-demand profiling of a service.
+    Two CPU modes are available, both stopped automatically after N seconds:
+      - "sampling": samples the stacks of every thread, output as collapsed stacks or top functions;
+      - "cprofile": deterministic profile of the hot-path functions, output as pstats.
+    When no session is running, instrumented functions only update their counters.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.session = None
+        self.result = None
+        self.tracemalloc_snapshot = None
+
+    # Hot paths
+
+    def hot_path(self, func):
+        """
+        Decorator counting calls and time of a function, and profiling it during cprofile sessions.
+        """
+        counter = self.counters.setdefault(func.__qualname__, HotPathCounter())
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            session = self.session
+            start = time.perf_counter_ns()
+            try:
+                if session is not None and session["mode"] == "cprofile" and sys.getprofile() is None:
+                    return session["profiler"]().runcall(func, *args, **kwargs)
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                counter.calls += 1
+                counter.total_ns += elapsed
+                if elapsed > counter.max_ns:
+                    counter.max_ns = elapsed
+        return wrapper
+
+    def counters_report(self) -> dict:
+        return {name: counter.to_dict() for name, counter in self.counters.items()}
+
+    # CPU profiling sessions
+
+    def start(self, mode: str, seconds: float) -> None:
+        if mode not in ("sampling", "cprofile"):
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        seconds = min(seconds, MAX_PROFILING_SECONDS)
+        with self.lock:
+            if self.session is not None:
+                raise RuntimeError("A profiling session is already running")
+            profilers = []
+            local = threading.local()
+
+            def thread_profiler() -> cProfile.Profile:
+                # cProfile objects are per thread: one is created for each thread running a hot path
+                if not hasattr(local, "profiler"):
+                    local.profiler = cProfile.Profile()
+                    with self.lock:
+                        # Thread idents are reused once a thread exits: keep every profiler
+                        profilers.append(local.profiler)
+                return local.profiler
+
+            self.session = {"mode": mode, "seconds": seconds, "started": time.time(),
+                            "profilers": profilers, "profiler": thread_profiler,
+                            "samples": Counter(), "stop": threading.Event()}
+            self.result = None
+        if mode == "sampling":
+            threading.Thread(target=self._sample, args=(self.session,), daemon=True).start()
+        threading.Thread(target=self._stop_after, args=(self.session,), daemon=True).start()
+
+    def _sample(self, session: dict) -> None:
+        own_ident = threading.get_ident()
+        while not session["stop"].wait(SAMPLING_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                session["samples"][";".join(reversed(stack))] += 1
+
+    def _stop_after(self, session: dict) -> None:
+        if not session["stop"].wait(session["seconds"]):
+            self.stop()
+
+    def stop(self) -> bool:
+        """
+        Stops the running session and stores its result. Returns False if nothing was running.
+        """
+        with self.lock:
+            session = self.session
+            if session is None:
+                return False
+            self.session = None
+        session["stop"].set()
+        self.result = {"mode": session["mode"], "duration": time.time() - session["started"],
+                       "samples": session["samples"], "profilers": list(session["profilers"])}
+        return True
+
+    def status(self) -> dict:
+        session = self.session
+        return {
+            "running": session is not None,
+            "mode": session["mode"] if session else None,
+            "elapsed": time.time() - session["started"] if session else None,
+            "result_available": self.result is not None,
+            "tracemalloc": tracemalloc.is_tracing(),
+        }
+
+    def collapsed(self) -> str:
+        """
+        Sampled stacks in collapsed format ("frame;frame;frame count"), as used by flame graph tools.
+        """
+        return "\n".join(f"{stack} {count}" for stack, count in self.result["samples"].most_common())
+
+    def pstats(self, sort: str = "cumulative", limit: int = 50) -> str:
+        stream = io.StringIO()
+        if self.result["mode"] == "cprofile":
+            profilers = self.result["profilers"]
+            if not profilers:
+                return "No hot path was called during the session\n"
+            stats = pstats.Stats(profilers[0], stream=stream)
+            for profiler in profilers[1:]:
+                stats.add(profiler)
+            stats.sort_stats(sort).print_stats(limit)
+        else:
+            # Sampling: self and cumulative sample counts per function
+            total = sum(self.result["samples"].values()) or 1
+            own, cumulative = Counter(), Counter()
+            for stack, count in self.result["samples"].items():
+                frames = stack.split(";")
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    cumulative[frame] += count
+            ranking = own if sort == "self" else cumulative
+            stream.write(f"{total} samples in {self.result['duration']:.1f}s\n")
+            stream.write(f"{'self%':>7} {'cumul%':>7}  function\n")
+            for frame, _ in ranking.most_common(limit):
+                stream.write(f"{100 * own[frame] / total:7.2f} {100 * cumulative[frame] / total:7.2f}  {frame}\n")
+        return stream.getvalue()
+
+    # Memory
+
+    def tracemalloc_start(self, frames: int = 10) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.tracemalloc_snapshot = None
+
+    def tracemalloc_stop(self) -> None:
+        tracemalloc.stop()
+        self.tracemalloc_snapshot = None
+
+    def tracemalloc_report(self, limit: int = 25, group_by: str = "lineno") -> str:
+        """
+        Top allocations, and their growth since the previous snapshot when there is one.
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB"]
+        if self.tracemalloc_snapshot is not None:
+            lines.append(f"Top {limit} growths since previous snapshot:")
+            lines += [str(stat) for stat in snapshot.compare_to(self.tracemalloc_snapshot, group_by)[:limit]]
+        else:
+            lines.append(f"Top {limit} allocations:")
+            lines += [str(stat) for stat in snapshot.statistics(group_by)[:limit]]
+        self.tracemalloc_snapshot = snapshot
+        return "\n".join(lines) + "\n"
+
+
+profiler = Profiler()
+hot_path = profiler.hot_path
+
+
+def _text(body: str) -> str:
+    response.content_type = 'text/plain; charset=utf-8'
+    return body
+
+
+def _error(status: int, message: str) -> dict:
+    response.status = status
+    return {"status": "error", "message": message}
+
+
+def profiling_app() -> Bottle:
+    """
+    Bottle app exposing the profiler, to be mounted on a service under /profiling.
+    """
+    app = Bottle()
+
+    @app.post('/start')
+    def start():
+        mode = request.query.get('mode', 'sampling')
+        try:
+            seconds = float(request.query.get('seconds', 10))
+            profiler.start(mode, seconds)
+        except ValueError as e:
+            return _error(400, str(e))
+        except RuntimeError as e:
+            return _error(409, str(e))
+        return {"status": "started", "mode": mode, "seconds": seconds}
+
+    @app.post('/stop')
+    def stop():
+        return {"status": "stopped" if profiler.stop() else "not running"}
+
+    @app.get('/status')
+    def status():
+        return profiler.status()
+
+    @app.get('/result')
+    def result():
+        if profiler.result is None:
+            return _error(404, "No profiling result available")
+        output = request.query.get('format', 'pstats')
+        if output == 'collapsed':
+            if profiler.result["mode"] != "sampling":
+                return _error(400, "Collapsed stacks are only available for sampling sessions")
+            return _text(profiler.collapsed())
+        return _text(profiler.pstats(request.query.get('sort', 'cumulative'), int(request.query.get('limit', 50))))
+
+    @app.get('/counters')
+    def counters():
+        return profiler.counters_report()
+
+    @app.post('/tracemalloc/start')
+    def tracemalloc_start():
+        profiler.tracemalloc_start(int(request.query.get('frames', 10)))
+        return {"status": "started"}
+
+    @app.post('/tracemalloc/stop')
+    def tracemalloc_stop():
+        profiler.tracemalloc_stop()
+        return {"status": "stopped"}
+
+    @app.get('/tracemalloc/snapshot')
+    def tracemalloc_snapshot():
+        try:
+            return _text(profiler.tracemalloc_report(int(request.query.get('limit', 25)),
+                                                     request.query.get('group_by', 'lineno')))
+        except RuntimeError as e:
+            return _error(409, str(e))
+
+    return app
+
+
+def start_profiling_server(port: int = PROFILING_PORT) -> None:
+    """
+    Serves the profiling endpoints in a background thread, for services without an HTTP API.
+    """
+    app = Bottle()
+    app.mount('/profiling', profiling_app())
+    thread = threading.Thread(target=run, kwargs={"app": app, "host": "0.0.0.0", "port": port, "quiet": True})
+    thread.daemon = True
+    thread.start()
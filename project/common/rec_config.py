@@ -0,0 +1,240 @@
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Path of the REC configuration, shared by every service through the config volume
+REC_CONFIG_PATH = os.getenv("REC_CONFIG_PATH", "config/REC.json")
+REC_CONFIG_POLL_INTERVAL = float(os.getenv("REC_CONFIG_POLL_INTERVAL", 2))
+
+
+class CompiledREC:
+    """
+    Indexed representation of REC.json.
+    Member and device ids are interned strings, devices are looked up by (member_id, device_id).
+    Every member and device also gets a dense integer id that stays stable across reloads
+    (ids of removed entries are not reused), so per-device state can be kept in arrays.
+    """
+    def __init__(self) -> None:
+        self.battery = {}
+        self.member_ids: List[str] = []
+        self.member_set = frozenset()
+        # (member_id, device_id) -> max-pi / cons, as written in REC.json
+        self.producers: Dict[Tuple[str, str], float] = {}
+        self.consumers: Dict[Tuple[str, str], float] = {}
+        # Dense ids, and the number of ids allocated so far (size of arrays indexed by id)
+        self.member_index: Dict[str, int] = {}
+        self.producer_index: Dict[Tuple[str, str], int] = {}
+        self.consumer_index: Dict[Tuple[str, str], int] = {}
+        self.member_slots = 0
+        self.producer_slots = 0
+        self.consumer_slots = 0
+
+    def has_member(self, member_id: str) -> bool:
+        return member_id in self.member_set
+
+    def has_consumer(self, member_id: str, consumer_id: str) -> bool:
+        return (member_id, consumer_id) in self.consumers
+
+    def has_producer(self, member_id: str, producer_id: str) -> bool:
+        return (member_id, producer_id) in self.producers
+
+    def max_pi(self, member_id: str, producer_id: str) -> float:
+        return self.producers[(member_id, producer_id)]
+
+    def cons(self, member_id: str, consumer_id: str) -> float:
+        return self.consumers[(member_id, consumer_id)]
+
+    def iter_producers(self):
+        """
+        Yields (member_id, producer_id, max_pi) for every producer.
+        """
+        for (member_id, producer_id), max_pi in self.producers.items():
+            yield member_id, producer_id, max_pi
+
+    def iter_consumers(self):
+        """
+        Yields (member_id, consumer_id, cons) for every consumer.
+        """
+        for (member_id, consumer_id), cons in self.consumers.items():
+            yield member_id, consumer_id, cons
+
+    def to_members(self) -> dict:
+        """
+        Rebuilds the nested {member: {"producers": ..., "consumers": ...}} layout of REC.json.
+        """
+        members = {member_id: {"producers": {}, "consumers": {}} for member_id in self.member_ids}
+        for member_id, producer_id, max_pi in self.iter_producers():
+            members[member_id]["producers"][producer_id] = {"max-pi": max_pi}
+        for member_id, consumer_id, cons in self.iter_consumers():
+            members[member_id]["consumers"][consumer_id] = {"cons": cons}
+        return members
+
+
+class ConfigDelta:
+    """
+    Differences between two compiled configurations.
+    Device entries are (member_id, device_id, value) tuples; changed entries carry the new value.
+    """
+    def __init__(self) -> None:
+        self.added_members: List[str] = []
+        self.removed_members: List[str] = []
+        self.added_producers: List[Tuple[str, str, float]] = []
+        self.removed_producers: List[Tuple[str, str, float]] = []
+        self.changed_producers: List[Tuple[str, str, float]] = []
+        self.added_consumers: List[Tuple[str, str, float]] = []
+        self.removed_consumers: List[Tuple[str, str, float]] = []
+        self.changed_consumers: List[Tuple[str, str, float]] = []
+        self.battery_changed = False
+
+    def is_empty(self) -> bool:
+        return not (self.added_members or self.removed_members
+                    or self.added_producers or self.removed_producers or self.changed_producers
+                    or self.added_consumers or self.removed_consumers or self.changed_consumers
+                    or self.battery_changed)
+
+    def __repr__(self) -> str:
+        return (f"ConfigDelta(+members={self.added_members}, -members={self.removed_members}, "
+                f"+producers={len(self.added_producers)}, -producers={len(self.removed_producers)}, "
+                f"~producers={len(self.changed_producers)}, "
+                f"+consumers={len(self.added_consumers)}, -consumers={len(self.removed_consumers)}, "
+                f"~consumers={len(self.changed_consumers)}, battery_changed={self.battery_changed})")
+
+
+def _allocate(index: dict, previous: dict, key, slots: int) -> int:
+    """
+    Gives a key the id it had in the previous compilation, or the next free id.
+    Returns the number of ids allocated.
+    """
+    if key in previous:
+        index[key] = previous[key]
+        return slots
+    index[key] = slots
+    return slots + 1
+
+
+def compile_rec(raw: dict, previous: Optional[CompiledREC] = None) -> CompiledREC:
+    """
+    Compiles the parsed REC.json into a CompiledREC.
+    When a previous compilation is given, surviving members and devices keep their dense ids.
+    Values are kept as written (e.g. an integer cons stays an integer, as in the tau_delta tags).
+    """
+    previous = previous or CompiledREC()
+    compiled = CompiledREC()
+    compiled.battery = dict(raw.get("battery", {}))
+    member_slots, producer_slots, consumer_slots = previous.member_slots, previous.producer_slots, previous.consumer_slots
+    for member_id, member_data in raw.get("members", {}).items():
+        member_id = sys.intern(member_id)
+        compiled.member_ids.append(member_id)
+        member_slots = _allocate(compiled.member_index, previous.member_index, member_id, member_slots)
+        for producer_id, producer_data in member_data.get("producers", {}).items():
+            key = (member_id, sys.intern(producer_id))
+            compiled.producers[key] = producer_data["max-pi"]
+            producer_slots = _allocate(compiled.producer_index, previous.producer_index, key, producer_slots)
+        for consumer_id, consumer_data in member_data.get("consumers", {}).items():
+            key = (member_id, sys.intern(consumer_id))
+            compiled.consumers[key] = consumer_data["cons"]
+            consumer_slots = _allocate(compiled.consumer_index, previous.consumer_index, key, consumer_slots)
+    compiled.member_set = frozenset(compiled.member_ids)
+    compiled.member_slots, compiled.producer_slots, compiled.consumer_slots = member_slots, producer_slots, consumer_slots
+    return compiled
+
+
+def load_rec(path: str = REC_CONFIG_PATH, previous: Optional[CompiledREC] = None) -> CompiledREC:
+    """
+    Reads and compiles the REC configuration file.
+    """
+    with open(path, 'r') as file:
+        raw = json.load(file)
+    return compile_rec(raw, previous)
+
+
+def _diff_devices(old: dict, new: dict, added: list, removed: list, changed: list) -> None:
+    for key, value in new.items():
+        if key not in old:
+            added.append((key[0], key[1], value))
+        elif old[key] != value:
+            changed.append((key[0], key[1], value))
+    for key, value in old.items():
+        if key not in new:
+            removed.append((key[0], key[1], value))
+
+
+def diff_rec(old: CompiledREC, new: CompiledREC) -> ConfigDelta:
+    """
+    Computes the members and devices added, removed or changed (max-pi, cons) between two compilations.
+    """
+    delta = ConfigDelta()
+    delta.added_members = [m for m in new.member_ids if not old.has_member(m)]
+    delta.removed_members = [m for m in old.member_ids if not new.has_member(m)]
+    _diff_devices(old.producers, new.producers, delta.added_producers, delta.removed_producers,
+                  delta.changed_producers)
+    _diff_devices(old.consumers, new.consumers, delta.added_consumers, delta.removed_consumers,
+                  delta.changed_consumers)
+    delta.battery_changed = old.battery != new.battery
+    return delta
+
+
+class ConfigWatcher:
+    """
+    Watches REC.json and notifies listeners with a ConfigDelta whenever
+    members or devices are added, removed or changed.
+    Listeners are called from the watcher thread with (compiled, delta).
+    """
+    def __init__(self, path: str = REC_CONFIG_PATH, poll_interval: float = REC_CONFIG_POLL_INTERVAL) -> None:
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.listeners: List[Callable[[CompiledREC, ConfigDelta], None]] = []
+        self.compiled = load_rec(self.path)
+        self._mtime = self._current_mtime()
+        self._thread = None
+
+    def _current_mtime(self) -> float:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return 0
+
+    def add_listener(self, listener: Callable[[CompiledREC, ConfigDelta], None]) -> None:
+        self.listeners.append(listener)
+
+    def check(self) -> Optional[ConfigDelta]:
+        """
+        Reloads the configuration if the file changed and dispatches the delta.
+        Returns the delta, or None if nothing changed.
+        """
+        mtime = self._current_mtime()
+        if mtime == self._mtime:
+            return None
+        try:
+            new = load_rec(self.path, self.compiled)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # Keep the current configuration while the file is being edited
+            print(f"WARNING: Failed to reload {self.path}: {e}", flush=True)
+            return None
+        self._mtime = mtime
+        with self.lock:
+            delta = diff_rec(self.compiled, new)
+            self.compiled = new
+        if delta.is_empty():
+            return None
+        print(f"INFO: REC configuration reloaded: {delta}", flush=True)
+        for listener in self.listeners:
+            try:
+                listener(new, delta)
+            except Exception as e:
+                print(f"ERROR: Config listener failed: {e}", flush=True)
+        return delta
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            self.check()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
@@ -0,0 +1,201 @@
+import atexit
+import datetime
+import os
+import signal
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pyarrow.dataset
+
+# Columnar export of the runs for offline analytics (disabled when RUN_EXPORT_DIR is empty).
+# pyarrow is imported only when the export is enabled.
+RUN_EXPORT_DIR = os.getenv("RUN_EXPORT_DIR", "")
+# Rows of the same time window (seconds) of a community are written as one row group,
+# at the latest once the window is over
+RUN_EXPORT_WINDOW = int(os.getenv("RUN_EXPORT_WINDOW", 60))
+# A file is closed (and readable) once its RUN_EXPORT_ROLL seconds period is over,
+# or once it holds RUN_EXPORT_FILE_ROWS rows
+RUN_EXPORT_ROLL = int(os.getenv("RUN_EXPORT_ROLL", 3600))
+RUN_EXPORT_FILE_ROWS = int(os.getenv("RUN_EXPORT_FILE_ROWS", 1000000))
+# Rows buffered per community and table before a row group is written anyway
+RUN_EXPORT_MAX_ROWS = int(os.getenv("RUN_EXPORT_MAX_ROWS", 100000))
+
+
+def timestamp_type():
+    """
+    Type of the timestamp column added to every table.
+    """
+    import pyarrow as pa
+    return pa.timestamp("ns", tz="UTC")
+
+
+class RunExporter:
+    """
+    Writes rows to Parquet datasets, one per table, laid out as
+        <root>/<table>/rec_id=<rec_id>/date=<YYYY-MM-DD>/part-<run_id>-<period>-<n>.parquet
+    Rows are buffered per table and community and written as one row group per time
+    window, so that readers can skip windows from the row-group statistics and
+    read only the columns they need (see open_dataset).
+    A file is written as .part-...parquet.tmp, which readers skip, and renamed once closed
+    (its footer is written only then), so a dataset can be read while a run is ongoing.
+    Schemas are given as (column, type name) pairs, e.g. ("value", "float64").
+    """
+    def __init__(self, root: str, schemas: dict, window_seconds: int = RUN_EXPORT_WINDOW,
+                 roll_seconds: int = RUN_EXPORT_ROLL, max_rows: int = RUN_EXPORT_MAX_ROWS,
+                 max_file_rows: int = RUN_EXPORT_FILE_ROWS, run_id: str = None) -> None:
+        import pyarrow as pa
+        self.root = root
+        self.schemas = {table: pa.schema([("timestamp", timestamp_type())] +
+                                         [(name, pa.type_for_alias(type_name)) for name, type_name in fields])
+                        for table, fields in schemas.items()}
+        self.window_seconds = window_seconds
+        self.window_ns = window_seconds * 10**9
+        self.roll_ns = roll_seconds * 10**9
+        self.max_rows = max_rows
+        self.max_file_rows = max_file_rows
+        self.run_id = run_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.lock = threading.Lock()
+        # (table, rec_id) -> (window, {column: values})
+        self.buffers = {}
+        # (table, rec_id) -> [roll period, date, ParquetWriter, rows, final path]
+        self.writers = {}
+        # (table, rec_id) -> files opened, numbering the parts so that a closed file is never overwritten
+        self.parts = {}
+        self.files = 0
+        self.rows = 0
+        self.row_groups = 0
+
+    def write(self, table: str, rec_id: str, timestamp: int, **row) -> None:
+        """
+        Appends a row (timestamp in nanoseconds) to the table of a community.
+        """
+        key = (table, rec_id)
+        window = timestamp // self.window_ns
+        with self.lock:
+            buffer = self.buffers.get(key)
+            if buffer is not None and (buffer[0] != window or len(buffer[1]["timestamp"]) >= self.max_rows):
+                self._flush(key)
+                buffer = None
+            if buffer is None:
+                buffer = self.buffers[key] = (window, {name: [] for name in self.schemas[table].names})
+            columns = buffer[1]
+            columns["timestamp"].append(timestamp)
+            for name, value in row.items():
+                columns[name].append(value)
+            self.rows += 1
+
+    def _flush(self, key: tuple) -> None:
+        # Must be called with self.lock held
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table, rec_id = key
+        _, columns = self.buffers.pop(key)
+        first = columns["timestamp"][0]
+        period = first // self.roll_ns
+        date = datetime.datetime.fromtimestamp(first / 1e9, datetime.timezone.utc).strftime("%Y-%m-%d")
+        current = self.writers.get(key)
+        if current is not None and (current[:2] != [period, date] or current[3] >= self.max_file_rows):
+            self._close(key)
+            current = None
+        if current is None:
+            directory = os.path.join(self.root, table, f"rec_id={rec_id}", f"date={date}")
+            os.makedirs(directory, exist_ok=True)
+            part = self.parts.get(key, 0)
+            self.parts[key] = part + 1
+            name = f"part-{self.run_id}-{period}-{part}.parquet"
+            writer = pq.ParquetWriter(os.path.join(directory, f".{name}.tmp"), self.schemas[table], compression="zstd")
+            current = self.writers[key] = [period, date, writer, 0, os.path.join(directory, name)]
+            self.files += 1
+        batch = pa.Table.from_pydict(columns, schema=self.schemas[table])
+        current[2].write_table(batch, row_group_size=batch.num_rows)
+        current[3] += batch.num_rows
+        self.row_groups += 1
+
+    def _close(self, key: tuple) -> None:
+        # Must be called with self.lock held
+        _, _, writer, _, path = self.writers.pop(key)
+        writer.close()
+        os.replace(writer.where, path)
+
+    def flush(self) -> None:
+        """
+        Writes every buffered window as a row group.
+        """
+        with self.lock:
+            for key in list(self.buffers):
+                self._flush(key)
+
+    def roll(self, now: int = None) -> None:
+        """
+        Writes the windows that are over and closes the files whose period is over, so that
+        the data of a running service becomes readable even when a community stops sending.
+        """
+        now = time.time_ns() if now is None else now
+        with self.lock:
+            for key in [key for key, (window, _) in self.buffers.items() if window < now // self.window_ns]:
+                self._flush(key)
+            for key in [key for key, (period, *_) in self.writers.items() if period < now // self.roll_ns]:
+                self._close(key)
+
+    def roll_loop(self) -> None:
+        while True:
+            time.sleep(self.window_seconds)
+            self.roll()
+
+    def start(self) -> None:
+        threading.Thread(target=self.roll_loop, daemon=True).start()
+
+    def close(self) -> None:
+        """
+        Flushes the buffers and closes the files (their footer is written only then).
+        """
+        with self.lock:
+            for key in list(self.buffers):
+                self._flush(key)
+            for key in list(self.writers):
+                self._close(key)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"rows": self.rows, "row_groups": self.row_groups, "files": self.files,
+                    "open_files": len(self.writers),
+                    "buffered": sum(len(columns["timestamp"]) for _, columns in self.buffers.values())}
+
+
+def create_exporter(schemas: dict, root: str = RUN_EXPORT_DIR):
+    """
+    Returns the started exporter of a service, or None when the export is disabled.
+    The files are closed on exit, including on SIGTERM (docker stop): the SIGTERM handler
+    installed before is still called.
+    """
+    if not root:
+        return None
+    exporter = RunExporter(root, schemas)
+    exporter.start()
+    atexit.register(exporter.close)
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_sigterm(signum, frame):
+        exporter.close()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            sys.exit(0)
+    signal.signal(signal.SIGTERM, on_sigterm)
+    print(f"INFO: Exporting run data to {root} (run {exporter.run_id})", flush=True)
+    return exporter
+
+
+def open_dataset(root: str, table: str) -> "pyarrow.dataset.Dataset":
+    """
+    Opens an exported table lazily: nothing is read until scanned, e.g.
+        open_dataset(root, "battery").to_table(columns=["timestamp", "value"],
+                                               filter=ds.field("rec_id") == "default")
+    Partitions (rec_id, date) and row groups are skipped using the filter.
+    Files still being written are hidden (dot-prefixed) until closed.
+    """
+    import pyarrow.dataset as ds
+    return ds.dataset(os.path.join(root, table), format="parquet", partitioning="hive")
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import unittest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [PROJECT_DIR]
+
+from common.run_export import RunExporter, open_dataset
+
+SECOND = 10**9
+
+
+class RunExporterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.TemporaryDirectory()
+        self.exporter = RunExporter(self.root.name, {"battery": [("value", "float64")]},
+                                    window_seconds=10, roll_seconds=60, run_id="test")
+
+    def tearDown(self) -> None:
+        self.root.cleanup()
+
+    def read_values(self) -> list:
+        return sorted(open_dataset(self.root.name, "battery").to_table(columns=["value"])["value"].to_pylist())
+
+    def test_read_while_writing(self):
+        self.exporter.write("battery", "default", 0, value=1.0)
+        self.exporter.write("battery", "default", 61 * SECOND, value=2.0)
+        self.exporter.flush()
+        # The file of the first period is closed, the one of the second period is still open
+        self.exporter.roll(now=62 * SECOND)
+        self.assertEqual(self.exporter.stats()["open_files"], 1)
+        self.assertEqual(self.read_values(), [1.0])
+
+        self.exporter.close()
+        self.assertEqual(self.read_values(), [1.0, 2.0])
+        directory = os.path.join(self.root.name, "battery", "rec_id=default", "date=1970-01-01")
+        self.assertEqual(sorted(os.listdir(directory)), ["part-test-0-0.parquet", "part-test-1-1.parquet"])
+
+
+if __name__ == '__main__':
+    unittest.main()
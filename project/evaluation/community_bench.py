@@ -0,0 +1,207 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+# The services' modules are run in-process
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for service in ("", "sensors", "analyzer", "planner", "evaluation"):
+    sys.path.insert(0, os.path.join(PROJECT_DIR, service))
+
+from policy_eval import DEFAULT_CONFIG, NullPublisher, analyzer_snapshot
+from common.rec_config import ConfigWatcher
+from common.communities import FairScheduler, split_topic
+from sensors import Sensor
+from analyzer import Analyzer
+from planner import CommunityPlanners, Planner
+
+
+class BenchCommunity:
+    """
+    Sensor, analyzer and planner state of one community. Each round runs the sensor step and the
+    analysis in-process and hands the snapshot to the planner, which plans and dispatches it on
+    the shared planner threads (CommunityPlanners) to the executor stand-in, over HTTP.
+    InfluxDB queries and MQTT are not exercised.
+    """
+    def __init__(self, rec_id: str, config_path: str, threshold: int, executor_api: str) -> None:
+        self.rec_id = rec_id
+        self.sensor = Sensor(NullPublisher(), ConfigWatcher(config_path))
+        self.analyzer = Analyzer(threshold)
+        self.planner = Planner(executor_api=executor_api, rec_id=rec_id)
+        self.step = 0
+        self.cycles = 0
+        self.cpu = []
+
+    def activate(self, plan: dict) -> None:
+        """
+        Applies a plan received by the executor stand-in, as the actuators would.
+        """
+        for member_id, commands in plan.items():
+            for command in commands:
+                self.sensor.members[member_id]["consumers"][command["consumer_id"]]["activated"] = True
+
+    def cycle(self, round_start: float, latencies: list) -> None:
+        cpu_start = time.thread_time()
+        self.sensor.tick(self.step)
+        consumers = analyzer_snapshot(self.sensor.members)
+        activable = self.analyzer.get_activable_consumers(consumers, self.sensor.battery_value)
+        if activable:
+            self.planner.process_request({"members": activable, "battery": self.sensor.battery_value})
+        self.step += 1
+        self.cycles += 1
+        self.cpu.append(time.thread_time() - cpu_start)
+        latencies.append(time.perf_counter() - round_start)
+
+
+def start_executor_standin(communities: dict) -> ThreadingHTTPServer:
+    """
+    Executor stand-in: accepts the plans of every community and applies them to its sensor.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            rec_id, _ = split_topic(self.path)
+            plan = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            communities[rec_id].activate(plan)
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def wait_planners_idle(planners: CommunityPlanners, timeout: float = 30) -> None:
+    """
+    Waits until no snapshot or plan is waiting or being handled.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not any(p.planning or p.dispatching or p.requests.has_item or p.dispatch_slot.has_item
+                   for p in planners.planners.values()):
+            return
+        time.sleep(0.001)
+
+
+def build(count: int, config_path: str, threshold: int, executor_api: str) -> tuple:
+    """
+    Creates the communities and returns them with the memory they hold.
+    """
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    communities = {f"rec{i}": BenchCommunity(f"rec{i}", config_path, threshold, executor_api) for i in range(count)}
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return communities, memory
+
+
+def jain_index(values: list) -> float:
+    """
+    Jain's fairness index: 1 when every community got the same service, 1/n at worst.
+    """
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values)) if any(values) else 1.0
+
+
+def run(count: int, rounds: int, period: float, workers: int, config_path: str, threshold: int, seed: int) -> dict:
+    """
+    Runs the given number of communities on a shared worker pool, one round every period seconds,
+    and measures memory, CPU and round completion time per community, and the plans that went
+    through the shared planner threads.
+    """
+    random.seed(seed)
+    communities = {}
+    executor = start_executor_standin(communities)
+    built, memory = build(count, config_path, threshold, f"http://127.0.0.1:{executor.server_port}")
+    communities.update(built)
+    planners = CommunityPlanners({rec_id: community.planner for rec_id, community in communities.items()}, workers)
+    planners.start()
+    scheduler = FairScheduler(workers)
+    round_latencies = []
+    submitted = 0
+    # The planner logs every plan: keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        for r in range(rounds):
+            round_start = time.perf_counter()
+            latencies = []
+            round_latencies.append(latencies)
+            submitted += len(scheduler.submit_round({
+                rec_id: (lambda community=community, latencies=latencies: community.cycle(round_start, latencies))
+                for rec_id, community in communities.items()
+            }))
+            time.sleep(max(started + (r + 1) * period - time.perf_counter(), 0))
+        scheduler.wait_idle()
+        # Time for the planner threads to send the last plans after the last round
+        drain_start = time.perf_counter()
+        wait_planners_idle(planners)
+        drain = time.perf_counter() - drain_start
+    scheduler.pool.shutdown()
+    executor.shutdown()
+    planner_status = [planner.status() for planner in planners.planners.values()]
+
+    # Time until the last community of a round completes its cycle
+    completion = sorted(max(latencies) for latencies in round_latencies if latencies)
+    cpu = [c for community in communities.values() for c in community.cpu]
+    return {
+        "communities": count,
+        "memory_kib_per_community": memory / 1024 / count,
+        "cpu_us_per_cycle": 1e6 * statistics.mean(cpu),
+        "p50_round_ms": 1000 * statistics.median(completion),
+        "p99_round_ms": 1000 * completion[int(0.99 * (len(completion) - 1))],
+        "round_ms_per_community": 1000 * statistics.median(completion) / count,
+        "skipped_cycles": 1 - submitted / (count * rounds),
+        "fairness": jain_index([community.cycles for community in communities.values()]),
+        "snapshots": sum(status["received"] for status in planner_status),
+        "coalesced_snapshots": sum(status["coalesced"] for status in planner_status),
+        "plans_dispatched": sum(status["dispatched"] for status in planner_status),
+        "superseded_plans": sum(status["superseded_plans"] for status in planner_status),
+        "drain_ms": 1000 * drain,
+    }
+
+
+def stack_memory() -> float:
+    """
+    Peak RSS (MiB) of a process importing the sensors, analyzer and planner modules,
+    i.e. the fixed cost paid by every community when each one runs its own stack.
+    """
+    code = ("import resource, sys\n"
+            f"sys.path[:0] = [{PROJECT_DIR!r}] + [{PROJECT_DIR!r} + '/' + s for s in ('sensors', 'analyzer', 'planner')]\n"
+            "import sensors, analyzer, planner\n"
+            "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return int(output.split()[-1]) / 1024
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Per-community overhead of a multi-community deployment "
+                                                 "(sensors, analysis, shared planner threads and HTTP dispatch; "
+                                                 "without InfluxDB and MQTT).")
+    parser.add_argument("--communities", default="1,10,50,200", help="Comma-separated community counts")
+    parser.add_argument("--rounds", type=int, default=100, help="Rounds (steps) per community count")
+    parser.add_argument("--period", type=float, default=0.1, help="Seconds between rounds")
+    parser.add_argument("--workers", type=int, default=4, help="Threads of the shared worker pool and planner")
+    parser.add_argument("--threshold", type=int, default=30, help="IS_URGENT_THRESHOLD")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rows = [run(count, args.rounds, args.period, args.workers, args.config, args.threshold, args.seed)
+            for count in map(int, args.communities.split(','))]
+    print(pd.DataFrame(rows).to_string(index=False), flush=True)
+    print(f"INFO: One stack per community costs at least {stack_memory():.1f} MiB of interpreter and "
+          f"modules per service process", flush=True)
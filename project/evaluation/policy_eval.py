@@ -0,0 +1,220 @@
+import argparse
+import itertools
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+# The harness runs the services' own logic in-process: make their modules importable
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for service in ("", "sensors", "analyzer", "planner"):
+    sys.path.insert(0, os.path.join(PROJECT_DIR, service))
+
+from common.rec_config import ConfigWatcher
+from sensors import Sensor, MINUTES_IN_A_SIMULATION_STEP, SECONDS_IN_A_SIMULATION_STEP
+from traces import TraceReplay
+from analyzer import Analyzer, DBManager
+from planner import Planner
+
+DEFAULT_CONFIG = os.path.join(PROJECT_DIR, "recam-config", "REC.json")
+
+# Planner strategies that can be evaluated, by name.
+# New strategies are Planner subclasses overriding choose_consumers.
+PLANNER_STRATEGIES = {
+    "urgent-first": Planner,
+}
+
+
+class NullPublisher:
+    """
+    Stands in for the sensors' MQTTManager: the harness reads the state directly.
+    """
+    def publish_production(self, *args) -> None:
+        pass
+
+    def publish_tau_delta(self, *args) -> None:
+        pass
+
+    def publish_battery(self, *args) -> None:
+        pass
+
+
+class DeadlineTracker:
+    """
+    Follows each tau/delta request from its assignment to its completion
+    and measures whether it was fulfilled before its deadline.
+    """
+    def __init__(self) -> None:
+        self.open = {}
+        self.satisfied = 0
+        self.missed = 0
+        self.lateness = []
+
+    def observe(self, step: int, members: dict, was_active: set) -> None:
+        for member_id, member_data in members.items():
+            for consumer_id, consumer_data in member_data["consumers"].items():
+                key = (member_id, consumer_id)
+                # A consumer is deactivated by the sensors only when its tau is fulfilled
+                if key in was_active and not consumer_data["activated"] and key in self.open:
+                    assigned_step, deadline = self.open.pop(key)
+                    lateness = (step - assigned_step) * MINUTES_IN_A_SIMULATION_STEP - deadline
+                    if lateness <= 0:
+                        self.satisfied += 1
+                    else:
+                        self.missed += 1
+                        self.lateness.append(lateness)
+                if consumer_data["tau"] > 0 and key not in self.open:
+                    self.open[key] = (step, consumer_data["delta"])
+
+    def close(self, step: int) -> None:
+        """
+        Counts the requests still open at the end of the run whose deadline has already passed.
+        """
+        for assigned_step, deadline in self.open.values():
+            lateness = (step - assigned_step) * MINUTES_IN_A_SIMULATION_STEP - deadline
+            if lateness > 0:
+                self.missed += 1
+                self.lateness.append(lateness)
+
+
+def analyzer_snapshot(members: dict) -> dict:
+    """
+    Builds the consumers state the analyzer would read from the knowledge base.
+    """
+    consumers = {}
+    for member_id, member_data in members.items():
+        consumers[member_id] = {}
+        for consumer_id, consumer_data in member_data["consumers"].items():
+            state = DBManager.new_consumer_state(consumer_data["cons"])
+            state["tau"] = consumer_data["tau"]
+            state["delta"] = consumer_data["delta"]
+            state["active"] = consumer_data["activated"]
+            consumers[member_id][consumer_id] = state
+    return DBManager.calculate_cons_required(consumers)
+
+
+def run_scenario(task: tuple) -> dict:
+    """
+    Runs one seeded scenario and returns its goal metrics.
+    """
+    policy, seed, steps, analyzer_every, config_path, trace_path = task
+    random.seed(seed)
+    trace = TraceReplay(trace_path, step_seconds=SECONDS_IN_A_SIMULATION_STEP) if trace_path else None
+    sensor = Sensor(NullPublisher(), ConfigWatcher(config_path), trace,
+                    tau_delta_interval_bounds=policy["tau_delta_interval_bounds"])
+    analyzer = Analyzer(policy["is_urgent_threshold"])
+    planner = PLANNER_STRATEGIES[policy["strategy"]](executor_api=None)
+    tracker = DeadlineTracker()
+
+    external_energy = 0
+    curtailed_energy = 0
+    battery_sum = 0
+    for step in range(steps):
+        was_active = {(member_id, consumer_id)
+                      for member_id, member_data in sensor.members.items()
+                      for consumer_id, consumer_data in member_data["consumers"].items()
+                      if consumer_data["activated"]}
+        totals = sensor.step(step)
+        tracker.observe(step, sensor.members, was_active)
+        external_energy += totals["non_battery_consumption"]
+        curtailed_energy += totals["curtailed"]
+        battery_sum += totals["battery"]
+
+        # Analyze -> plan -> execute, as the MAPE loop does every SIMULATION_STEP
+        if step % analyzer_every == 0:
+            consumers = analyzer_snapshot(sensor.members)
+            activable = analyzer.get_activable_consumers(consumers, sensor.battery_value)
+            if activable:
+                plan = planner.choose_consumers({"members": activable, "battery": sensor.battery_value})
+                for member_id, commands in plan.items():
+                    for command in commands:
+                        sensor.members[member_id]["consumers"][command["consumer_id"]]["activated"] = True
+    tracker.close(steps)
+
+    requests = tracker.satisfied + tracker.missed
+    return {
+        "seed": seed,
+        "requests": requests,
+        "satisfaction_rate": tracker.satisfied / requests if requests else 1.0,
+        "deadline_misses": tracker.missed,
+        "mean_lateness_min": statistics.mean(tracker.lateness) if tracker.lateness else 0.0,
+        "external_energy_kwh": external_energy,
+        "unused_stored_energy_kwh": sensor.battery_value,
+        "curtailed_energy_kwh": curtailed_energy,
+        "mean_battery_kwh": battery_sum / steps,
+    }
+
+
+def confidence_interval(values: list, z: float = 1.96) -> tuple:
+    """
+    Returns the mean and the half-width of its normal-approximation confidence interval.
+    """
+    mean = statistics.mean(values)
+    if len(values) < 2:
+        return mean, float("nan")
+    return mean, z * statistics.stdev(values) / math.sqrt(len(values))
+
+
+def evaluate(policies: list, scenarios: int, steps: int, analyzer_every: int,
+             config_path: str = DEFAULT_CONFIG, trace_path: str = None, workers: int = None,
+             base_seed: int = 0) -> pd.DataFrame:
+    """
+    Evaluates each policy on the same seeded scenarios across a process pool
+    and returns one row per policy with mean and 95% confidence interval of each metric.
+    """
+    tasks = [(policy, base_seed + i, steps, analyzer_every, config_path, trace_path)
+             for policy in policies for i in range(scenarios)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_scenario, tasks, chunksize=max(1, len(tasks) // (8 * (workers or os.cpu_count())))))
+
+    rows = []
+    for p, policy in enumerate(policies):
+        policy_results = results[p * scenarios:(p + 1) * scenarios]
+        row = {
+            "strategy": policy["strategy"],
+            "threshold": policy["is_urgent_threshold"],
+            "interval_bounds": "{},{}".format(*policy["tau_delta_interval_bounds"]),
+        }
+        for metric in ("satisfaction_rate", "deadline_misses", "mean_lateness_min", "external_energy_kwh",
+                       "unused_stored_energy_kwh", "curtailed_energy_kwh"):
+            mean, half_width = confidence_interval([r[metric] for r in policy_results])
+            row[metric] = f"{mean:.3f} ± {half_width:.3f}"
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Monte Carlo evaluation of analyzer/planner policies.")
+    parser.add_argument("--scenarios", type=int, default=1000, help="Seeded scenarios per policy")
+    parser.add_argument("--steps", type=int, default=1440, help="Simulation steps per scenario")
+    parser.add_argument("--analyzer-every", type=int, default=2, help="Sensor steps between analyzer cycles")
+    parser.add_argument("--thresholds", default="30", help="Comma-separated IS_URGENT_THRESHOLD values")
+    parser.add_argument("--bounds", default="60,120",
+                        help="Semicolon-separated TAU_DELTA_INTERVAL_BOUNDS values, e.g. '60,90;60,120'")
+    parser.add_argument("--strategies", default="urgent-first", help="Comma-separated planner strategies")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--trace", default=None, help="Production trace (.npy) replayed by the sensors")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    policies = [
+        {"strategy": strategy, "is_urgent_threshold": threshold, "tau_delta_interval_bounds": bounds}
+        for strategy, threshold, bounds in itertools.product(
+            args.strategies.split(','),
+            map(int, args.thresholds.split(',')),
+            [tuple(map(int, b.split(','))) for b in args.bounds.split(';')],
+        )
+    ]
+    start = time.time()
+    df = evaluate(policies, args.scenarios, args.steps, args.analyzer_every, args.config, args.trace,
+                  args.workers, args.seed)
+    print(df.to_string(index=False), flush=True)
+    print(f"INFO: Evaluated {len(policies) * args.scenarios} scenarios in {time.time() - start:.1f}s", flush=True)
@@ -0,0 +1,116 @@
+import argparse
+import os
+import sys
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from common.run_export import open_dataset, timestamp_type
+
+
+def scan(root: str, table: str, columns: list, filter=None):
+    """
+    Streams the record batches of the given columns only; partitions and row groups
+    outside the filter are not read. Yields nothing if the table was not exported.
+    """
+    if not os.path.isdir(os.path.join(root, table)):
+        return
+    for batch in open_dataset(root, table).to_batches(columns=["rec_id"] + columns, filter=filter):
+        if batch.num_rows:
+            yield pa.Table.from_batches([batch])
+
+
+def aggregate(root: str, table: str, aggregations: list, filter=None) -> pd.DataFrame:
+    """
+    Sums and counts per community, batch by batch, so that memory does not grow with the run.
+    """
+    columns = sorted({column for column, _ in aggregations})
+    partials = [batch.group_by("rec_id").aggregate(aggregations).to_pandas()
+                for batch in scan(root, table, columns, filter)]
+    if not partials:
+        return pd.DataFrame()
+    return pd.concat(partials).groupby("rec_id").sum()
+
+
+def snapshots(root: str, table: str, filter=None) -> set:
+    """
+    (rec_id, snapshot_id) of the snapshots present in a decisions table.
+    """
+    pairs = set()
+    for batch in scan(root, table, ["snapshot_id"], filter):
+        unique = batch.group_by(["rec_id", "snapshot_id"]).aggregate([])
+        pairs.update(zip(unique["rec_id"].to_pylist(), unique["snapshot_id"].to_pylist()))
+    return pairs
+
+
+def analyse(root: str, filter=None) -> pd.DataFrame:
+    """
+    Energy and decision provenance indices per community, computed from the exported run.
+    """
+    production = aggregate(root, "production", [("value", "sum")], filter)
+    battery = aggregate(root, "battery", [("value", "sum"), ("value", "count"),
+                                          ("non_battery_consumption", "sum"), ("battery_consumption", "sum")], filter)
+    analyzed = aggregate(root, "analyzer_decisions", [("activable", "sum"), ("urgent", "sum"),
+                                                      ("activable", "count")], filter)
+    planned = aggregate(root, "planner_decisions", [("chosen", "sum"), ("urgent", "sum"), ("chosen", "count")], filter)
+
+    # Snapshots sent to the planner (something activable) that were superseded before being planned
+    activable_filter = ds.field("activable") if filter is None else filter & ds.field("activable")
+    sent = snapshots(root, "analyzer_decisions", activable_filter)
+    superseded = pd.Series([rec_id for rec_id, _ in sent - snapshots(root, "planner_decisions", filter)],
+                           dtype=object).value_counts()
+    sent = pd.Series([rec_id for rec_id, _ in sent], dtype=object).value_counts()
+
+    df = pd.DataFrame(index=sorted(set(production.index) | set(battery.index) | set(analyzed.index) | set(planned.index)))
+    df.index.name = "rec_id"
+    if not production.empty:
+        df["produced_kwh"] = production["value_sum"]
+    if not battery.empty:
+        df["battery_kwh"] = battery["battery_consumption_sum"]
+        df["external_kwh"] = battery["non_battery_consumption_sum"]
+        df["mean_stored_kwh"] = battery["value_sum"] / battery["value_count"]
+    if not analyzed.empty:
+        df["pending_consumer_cycles"] = analyzed["activable_count"]
+        df["activable_rate"] = analyzed["activable_sum"] / analyzed["activable_count"]
+        df["urgent"] = analyzed["urgent_sum"]
+    df["snapshots_sent"] = sent
+    df["snapshots_superseded"] = superseded
+    if not planned.empty:
+        df["chosen"] = planned["chosen_sum"]
+        df["chosen_rate"] = planned["chosen_sum"] / planned["chosen_count"]
+    return df.fillna(0)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Analyse a run exported with RUN_EXPORT_DIR, without InfluxDB.")
+    parser.add_argument("root", help="RUN_EXPORT_DIR of the run")
+    parser.add_argument("--rec-id", default=None, help="Only this community")
+    parser.add_argument("--since", default=None, help="ISO timestamp (UTC)")
+    parser.add_argument("--until", default=None, help="ISO timestamp (UTC)")
+    return parser.parse_args()
+
+
+def build_filter(rec_id: str = None, since: str = None, until: str = None):
+    conditions = []
+    if rec_id is not None:
+        conditions.append(ds.field("rec_id") == rec_id)
+    if since is not None:
+        conditions.append(ds.field("timestamp") >= pa.scalar(pd.Timestamp(since, tz="UTC").value, type=timestamp_type()))
+    if until is not None:
+        conditions.append(ds.field("timestamp") < pa.scalar(pd.Timestamp(until, tz="UTC").value, type=timestamp_type()))
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    return condition
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    start = time.time()
+    df = analyse(args.root, build_filter(args.rec_id, args.since, args.until))
+    print(df.to_string(), flush=True)
+    print(f"INFO: Analysed {args.root} in {time.time() - start:.1f}s", flush=True)
@@ -0,0 +1,159 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+# The services' modules are run in-process (also in the worker processes)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for service in ("", "sensors", "analyzer", "planner", "evaluation"):
+    sys.path.insert(0, os.path.join(PROJECT_DIR, service))
+
+from policy_eval import DEFAULT_CONFIG, NullPublisher, analyzer_snapshot
+from common.rec_config import ConfigWatcher
+from sensors import Sensor, MINUTES_IN_A_SIMULATION_STEP
+from analyzer import Analyzer, AdaptiveScheduler
+from planner import Planner
+
+# Each analyzer cycle issues two Flux queries (battery and tau/delta)
+QUERIES_PER_CYCLE = 2
+
+
+def consumer_states(members: dict) -> dict:
+    """
+    (assigned, active) of every consumer, i.e. what the analyzer's state-change listener watches.
+    """
+    return {(member_id, consumer_id): (consumer_data["tau"] > 0, consumer_data["activated"])
+            for member_id, member_data in members.items()
+            for consumer_id, consumer_data in member_data["consumers"].items()}
+
+
+def run_scenario(task: tuple) -> dict:
+    """
+    Runs one seeded scenario with the fixed or the adaptive analyzer loop.
+    One sensor step lasts one second of wall-clock time. State changes reach the adaptive
+    loop at once (MQTT), but a cycle reads the state of ingest_lag steps before (InfluxDB).
+    """
+    (adaptive, seed, steps, threshold, bounds, fixed_interval, min_interval, max_interval, ingest_lag,
+     config_path) = task
+    random.seed(seed)
+    sensor = Sensor(NullPublisher(), ConfigWatcher(config_path), tau_delta_interval_bounds=bounds)
+    analyzer = Analyzer(threshold)
+    planner = Planner(executor_api=None)
+    scheduler = AdaptiveScheduler(threshold, fixed_interval, min_interval, max_interval,
+                                  simulation_speed=MINUTES_IN_A_SIMULATION_STEP, ingest_delay=ingest_lag)
+
+    states = consumer_states(sensor.members)
+    crossed_at = {}
+    detected = set()
+    delays = []
+    cycles = 0
+    next_cycle = 0
+    # States readable from the knowledge base, oldest first
+    ingested = deque(maxlen=ingest_lag + 1)
+    for step in range(steps):
+        sensor.step(step)
+        now = step + 1
+
+        # Ground truth: when each pending consumer's slack crossed the urgency threshold
+        for member_id, member_data in sensor.members.items():
+            for consumer_id, consumer_data in member_data["consumers"].items():
+                key = (member_id, consumer_id)
+                pending = consumer_data["tau"] > 0 and not consumer_data["activated"]
+                if pending and consumer_data["delta"] - consumer_data["tau"] < threshold:
+                    crossed_at.setdefault(key, now)
+                else:
+                    crossed_at.pop(key, None)
+                    detected.discard(key)
+
+        ingested.append((analyzer_snapshot(sensor.members), sensor.battery_value))
+        new_states = consumer_states(sensor.members)
+        changed = new_states != states
+        states = new_states
+        if adaptive and changed:
+            scheduler.notify(now)
+        if not (now >= next_cycle or (adaptive and changed)):
+            continue
+
+        cycles += 1
+        consumers, battery_level = ingested[0]
+        activable = analyzer.get_activable_consumers(consumers, battery_level)
+        for member_id, member_consumers in activable.items():
+            for consumer in member_consumers:
+                key = (member_id, consumer["consumer_id"])
+                if consumer["isUrgent"] and key not in detected and key in crossed_at:
+                    detected.add(key)
+                    delays.append(now - crossed_at[key])
+        if activable:
+            plan = planner.choose_consumers({"members": activable, "battery": battery_level})
+            for member_id, commands in plan.items():
+                for command in commands:
+                    sensor.members[member_id]["consumers"][command["consumer_id"]]["activated"] = True
+            states = consumer_states(sensor.members)
+
+        if adaptive:
+            scheduler.observe(battery_level, now)
+            delay = scheduler.next_delay(consumers, battery_level, activable)
+            next_cycle = now + scheduler.follow_up(delay, now, now)
+        else:
+            next_cycle = now + fixed_interval
+
+    return {
+        "queries": QUERIES_PER_CYCLE * cycles,
+        "mean_detection_delay_s": statistics.mean(delays) if delays else 0.0,
+        "max_detection_delay_s": max(delays) if delays else 0.0,
+    }
+
+
+def compare(scenarios: int, steps: int, threshold: int, bounds: tuple, fixed_interval: float,
+            min_interval: float, max_interval: float, ingest_lag: int = 1,
+            config_path: str = DEFAULT_CONFIG, workers: int = None, base_seed: int = 0) -> pd.DataFrame:
+    """
+    Runs the same seeded scenarios with both loops and summarizes query load and detection delay.
+    """
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for adaptive in (False, True):
+            tasks = [(adaptive, base_seed + i, steps, threshold, bounds, fixed_interval, min_interval,
+                      max_interval, ingest_lag, config_path) for i in range(scenarios)]
+            results = list(pool.map(run_scenario, tasks))
+            rows.append({
+                "loop": "adaptive" if adaptive else "fixed",
+                "queries_per_hour": statistics.mean(r["queries"] for r in results) * 3600 / steps,
+                "mean_detection_delay_s": statistics.mean(r["mean_detection_delay_s"] for r in results),
+                "worst_detection_delay_s": max(r["max_detection_delay_s"] for r in results),
+            })
+    df = pd.DataFrame(rows)
+    df["query_reduction"] = 1 - df["queries_per_hour"] / df["queries_per_hour"][0]
+    return df
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the fixed and the adaptive analyzer loops.")
+    parser.add_argument("--scenarios", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=1440, help="Sensor steps (seconds) per scenario")
+    parser.add_argument("--threshold", type=int, default=30, help="IS_URGENT_THRESHOLD")
+    parser.add_argument("--bounds", default="60,120", help="TAU_DELTA_INTERVAL_BOUNDS")
+    parser.add_argument("--fixed-interval", type=float, default=2, help="SIMULATION_STEP of the fixed loop")
+    parser.add_argument("--min-interval", type=float, default=0.5, help="MIN_SIMULATION_STEP")
+    parser.add_argument("--max-interval", type=float, default=30, help="MAX_SIMULATION_STEP")
+    parser.add_argument("--ingest-lag", type=int, default=1,
+                        help="Steps (seconds) before a state change is readable from InfluxDB (INGEST_DELAY)")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    start = time.time()
+    df = compare(args.scenarios, args.steps, args.threshold, tuple(map(int, args.bounds.split(','))),
+                 args.fixed_interval, args.min_interval, args.max_interval, args.ingest_lag, args.config,
+                 args.workers, args.seed)
+    print(df.to_string(index=False), flush=True)
+    print(f"INFO: Compared {2 * args.scenarios} scenarios in {time.time() - start:.1f}s", flush=True)
@@ -0,0 +1,191 @@
+import argparse
+import gzip
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for service in ("", "sensors"):
+    sys.path.insert(0, os.path.join(PROJECT_DIR, service))
+
+from sensors import InfluxWriter, LineProtocol, MQTTManager
+
+TELEGRAF_SNIPPET = """
+# Telegraf configuration for the "telegraf" mode: point the outputs at the stand-in
+[agent]
+    omit_hostname = true
+    interval = "1s"
+    flush_interval = "1s"
+[[inputs.mqtt_consumer]]
+    servers = ["tcp://{broker}:{broker_port}"]
+    topics = ["/producer/+/+"]
+    data_format = "influx"
+[[outputs.influxdb_v2]]
+    urls = ["http://{host}:{port}"]
+    token = "token"
+    organization = "RECAM"
+    bucket = "RECAM"
+"""
+
+
+def run_standin(port: int, results, ready) -> None:
+    """
+    Minimal InfluxDB stand-in: accepts /api/v2/write, and records for each line the
+    delay between its timestamp and its arrival, plus the server CPU time.
+    """
+    latencies = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            arrival = time.time_ns()
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            for line in body.splitlines():
+                if line:
+                    latencies.append((arrival - int(line.rsplit(b" ", 1)[1])) / 1e6)
+            self.send_response(204)
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path == "/results":
+                results.put(list(latencies))
+                latencies.clear()
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    ready.set()
+    server.serve_forever()
+
+
+def drive(sink, records_per_step: int, steps: int, step_duration: float) -> float:
+    """
+    Emits production records like the sensors loop and returns the CPU time spent by the sender.
+    """
+    cpu_start = time.process_time()
+    for step in range(steps):
+        started = time.time()
+        timestamp = time.time_ns()
+        for producer in range(records_per_step):
+            sink.publish_production(f"m{producer // 10}", f"p{producer % 10}", 0.5, timestamp)
+        time.sleep(max(step_duration - (time.time() - started), 0))
+    return time.process_time() - cpu_start
+
+
+class DirectSink:
+    def __init__(self, writer: InfluxWriter) -> None:
+        self.writer = writer
+
+    def publish_production(self, *args) -> None:
+        self.writer.write(LineProtocol.production(*args))
+
+
+def collect(port: int, results, wait: float) -> list:
+    import urllib.request
+    time.sleep(wait)
+    urllib.request.urlopen(f"http://127.0.0.1:{port}/results").read()
+    return results.get(timeout=10)
+
+
+def start_telegraf(binary: str, broker: str, broker_port: int, port: int) -> subprocess.Popen:
+    """
+    Runs Telegraf between the broker and the stand-in, so that its CPU time can be measured.
+    """
+    config = tempfile.NamedTemporaryFile("w", suffix=".conf", delete=False)
+    config.write(TELEGRAF_SNIPPET.format(broker=broker, broker_port=broker_port, host="127.0.0.1", port=port))
+    config.close()
+    process = subprocess.Popen([binary, "--config", config.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Leave Telegraf time to connect and subscribe
+    time.sleep(3)
+    return process
+
+
+def stop_telegraf(process: subprocess.Popen) -> float:
+    """
+    Stops Telegraf and returns the CPU time (user + system) it used.
+    """
+    process.terminate()
+    _, _, usage = os.wait4(process.pid, 0)
+    return usage.ru_utime + usage.ru_stime
+
+
+def summarize(path: str, latencies: list, cpu: float, records: int, relay_cpu: float = None) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "path": path,
+        "records_received": len(latencies),
+        "records_sent": records,
+        "p50_latency_ms": statistics.median(latencies) if latencies else None,
+        "p99_latency_ms": latencies[int(0.99 * (len(latencies) - 1))] if latencies else None,
+        "max_latency_ms": latencies[-1] if latencies else None,
+        "sender_cpu_us_per_record": 1e6 * cpu / records,
+        # CPU of the processes between the sender and InfluxDB (Telegraf), when run by the benchmark
+        "relay_cpu_us_per_record": 1e6 * relay_cpu / records if relay_cpu is not None else None,
+        "total_cpu_us_per_record": 1e6 * (cpu + (relay_cpu or 0)) / records,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare direct InfluxDB writes with the MQTT/Telegraf path.")
+    parser.add_argument("--records-per-step", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--step-duration", type=float, default=1)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--flush-interval", type=int, default=200, help="Milliseconds")
+    parser.add_argument("--port", type=int, default=18086, help="Port of the InfluxDB stand-in")
+    parser.add_argument("--broker", default=None,
+                        help="MQTT broker for the telegraf mode; Telegraf must write to the stand-in, "
+                             "run with --telegraf or configured with --print-telegraf-config")
+    parser.add_argument("--broker-port", type=int, default=1883)
+    parser.add_argument("--telegraf", default=None,
+                        help="Telegraf binary: run by the benchmark (and its CPU time measured) in the telegraf mode")
+    parser.add_argument("--print-telegraf-config", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.print_telegraf_config:
+        print(TELEGRAF_SNIPPET.format(broker=args.broker or "broker", broker_port=args.broker_port,
+                                      host="<bench host>", port=args.port))
+        sys.exit(0)
+
+    results = multiprocessing.Queue()
+    ready = multiprocessing.Event()
+    standin = multiprocessing.Process(target=run_standin, args=(args.port, results, ready), daemon=True)
+    standin.start()
+    ready.wait()
+    records = args.records_per_step * args.steps
+    rows = []
+
+    writer = InfluxWriter(f"http://127.0.0.1:{args.port}", "token", "RECAM", "RECAM",
+                          batch_size=args.batch_size, flush_interval=args.flush_interval)
+    cpu = drive(DirectSink(writer), args.records_per_step, args.steps, args.step_duration)
+    writer.close()
+    rows.append(summarize("direct", collect(args.port, results, 1), cpu, records))
+
+    if args.broker:
+        telegraf = start_telegraf(args.telegraf, args.broker, args.broker_port, args.port) if args.telegraf else None
+        mqtt_manager = MQTTManager(args.broker, args.broker_port, "/producer/{member_id}/{prod_id}",
+                                   "/consumer/taudelta/{member_id}/{cons_id}", "/battery")
+        mqtt_manager.client.loop_start()
+        cpu = drive(mqtt_manager, args.records_per_step, args.steps, args.step_duration)
+        # Leave Telegraf time for its last flush
+        latencies = collect(args.port, results, 3)
+        relay_cpu = stop_telegraf(telegraf) if telegraf is not None else None
+        rows.append(summarize("mqtt+telegraf", latencies, cpu, records, relay_cpu))
+    else:
+        print("WARNING: No --broker given, the MQTT/Telegraf path was not measured", flush=True)
+
+    print(pd.DataFrame(rows).to_string(index=False), flush=True)
+    standin.terminate()
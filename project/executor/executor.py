@@ -1,7 +1,13 @@
 import json
 import os
+import threading
+import time
+from collections import OrderedDict, deque
 from bottle import Bottle, request, run, HTTPResponse
 import paho.mqtt.client as mqtt
+from common.rec_config import ConfigWatcher
+from common.profiling import profiling_app
+from common.communities import DEFAULT_REC, discover_communities, namespaced_topic
 
 # Set debug flag based on environment variable
 DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1", "yes")
@@ -11,14 +17,226 @@ def debug_print(msg):
     if DEBUG:
         print(msg, flush=True)
 
+# Delivery parameters of the activation commands
+MQTT_QOS = int(os.getenv("MQTT_QOS", 1))
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", 20))
+DELIVERY_TIMEOUT = float(os.getenv("DELIVERY_TIMEOUT", 30))
+MAX_TRACKED_PLANS = int(os.getenv("MAX_TRACKED_PLANS", 100))
+# Number of threads serving the executor API
+API_THREADS = int(os.getenv("API_THREADS", 8))
+THROUGHPUT_WINDOW = 60  # seconds
+
+class DeliveryTracker:
+    """
+    Tracks the delivery of every published command, grouped by plan.
+    A command is pending until the broker acknowledges it (PUBACK for QoS 1,
+    PUBCOMP for QoS 2) and failed if it is rejected or not acknowledged in time.
+    The number of unacknowledged commands is bounded by an inflight window per
+    community, so that the backlog of a community does not delay the others.
+    An expired command is still retried by the MQTT client: if it is acknowledged
+    later, it is moved from failed to delivered.
+    """
+    def __init__(self, max_inflight: int, delivery_timeout: float, max_tracked_plans: int) -> None:
+        self.max_inflight = max_inflight
+        self.delivery_timeout = delivery_timeout
+        self.max_tracked_plans = max_tracked_plans
+        # rec_id -> inflight window
+        self.windows = {}
+        # Plans are tracked from new_plan until close_plan (open) and then until all their commands settle
+        self.lock = threading.Lock()
+        self.plans = OrderedDict()
+        self.next_plan_id = 0
+        # mid -> (plan_id, command, publish time, inflight window of the plan's community)
+        self.pending = {}
+        # Acknowledgements received before their mid was registered
+        self.early_acks = {}
+        # mid -> (plan_id, command, publish time) of the commands expired but not yet acknowledged
+        self.expired = {}
+        self.published = 0
+        self.delivered = 0
+        self.failed = 0
+        self.latency_sum = 0
+        self.latency_max = 0
+        self.recent_deliveries = deque()
+
+    def new_plan(self, rec_id: str = DEFAULT_REC) -> int:
+        with self.lock:
+            plan_id = self.next_plan_id
+            self.next_plan_id += 1
+            self.plans[plan_id] = {"rec_id": rec_id, "open": True, "delivered": [], "pending": [], "failed": [],
+                                   "created": time.time()}
+            self._evict()
+            return plan_id
+
+    def close_plan(self, plan_id: int) -> None:
+        """
+        Called once every command of the plan went through publish_message: from then on the
+        plan can be forgotten as soon as its commands are settled.
+        """
+        with self.lock:
+            self.plans[plan_id]["open"] = False
+            self._evict()
+
+    def _evict(self) -> None:
+        # Must be called with self.lock held: forgets the oldest finished plans beyond the limit
+        for plan_id, plan in list(self.plans.items()):
+            if len(self.plans) <= self.max_tracked_plans:
+                break
+            if not plan["open"] and not plan["pending"]:
+                del self.plans[plan_id]
+
+    def window(self, rec_id: str) -> threading.BoundedSemaphore:
+        with self.lock:
+            if rec_id not in self.windows:
+                self.windows[rec_id] = threading.BoundedSemaphore(self.max_inflight)
+            return self.windows[rec_id]
+
+    def acquire(self, rec_id: str) -> bool:
+        """
+        Waits for a free slot in the inflight window of the community.
+        """
+        return self.window(rec_id).acquire(timeout=self.delivery_timeout)
+
+    def register(self, mid: int, plan_id: int, rec_id: str, command: str) -> None:
+        """
+        Records a command accepted by the client, waiting for its acknowledgement.
+        """
+        window = self.window(rec_id)
+        now = time.time()
+        with self.lock:
+            self.published += 1
+            self.plans[plan_id]["pending"].append(command)
+            self.pending[mid] = (plan_id, command, now, window)
+            # The client reuses a mid only once the previous message is gone
+            self.expired.pop(mid, None)
+            if mid in self.early_acks:
+                self._settle(mid, self.early_acks.pop(mid), delivered=True)
+
+    def fail(self, plan_id: int, rec_id: str, command: str, reason: str, release: bool = True) -> None:
+        """
+        Records a command that could not be published.
+        """
+        with self.lock:
+            self.failed += 1
+            self.plans[plan_id]["failed"].append(command)
+        if release:
+            self.window(rec_id).release()
+        print(f"ERROR: Command {command} of plan {plan_id} failed: {reason}", flush=True)
+
+    def acknowledge(self, mid: int) -> None:
+        """
+        Called from the MQTT network thread when the broker acknowledges a message.
+        """
+        now = time.time()
+        with self.lock:
+            if mid in self.pending:
+                self._settle(mid, now, delivered=True)
+            elif mid in self.expired:
+                self._reconcile(mid, now)
+            else:
+                self.early_acks[mid] = now
+
+    def expire(self) -> None:
+        """
+        Marks as failed the commands not acknowledged within the delivery timeout.
+        """
+        now = time.time()
+        with self.lock:
+            expired = [mid for mid, (_, _, published_at, _) in self.pending.items()
+                       if now - published_at > self.delivery_timeout]
+            for mid in expired:
+                self._settle(mid, now, delivered=False)
+            for mid in [mid for mid, acked_at in self.early_acks.items() if now - acked_at > self.delivery_timeout]:
+                del self.early_acks[mid]
+
+    def _settle(self, mid: int, now: float, delivered: bool) -> None:
+        # Must be called with self.lock held
+        plan_id, command, published_at, window = self.pending.pop(mid)
+        plan = self.plans.get(plan_id)
+        if plan is not None:
+            plan["pending"].remove(command)
+            plan["delivered" if delivered else "failed"].append(command)
+        if delivered:
+            self._record_delivery(now, published_at)
+        else:
+            self.failed += 1
+            self.expired[mid] = (plan_id, command, published_at)
+            print(f"ERROR: Command {command} of plan {plan_id} not acknowledged within {self.delivery_timeout}s", flush=True)
+        window.release()
+
+    def _reconcile(self, mid: int, now: float) -> None:
+        # Must be called with self.lock held: an expired command was acknowledged after all
+        plan_id, command, published_at = self.expired.pop(mid)
+        plan = self.plans.get(plan_id)
+        if plan is not None:
+            plan["failed"].remove(command)
+            plan["delivered"].append(command)
+        self.failed -= 1
+        self._record_delivery(now, published_at)
+        print(f"INFO: Command {command} of plan {plan_id} acknowledged after expiring", flush=True)
+
+    def _record_delivery(self, now: float, published_at: float) -> None:
+        latency = max(now - published_at, 0)
+        self.delivered += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.recent_deliveries.append(now)
+
+    def status(self, plan_id: int = None) -> dict:
+        self.expire()
+        now = time.time()
+        with self.lock:
+            while self.recent_deliveries and now - self.recent_deliveries[0] > THROUGHPUT_WINDOW:
+                self.recent_deliveries.popleft()
+            if plan_id is not None:
+                plan = self.plans.get(plan_id)
+                return {"plan_id": plan_id, **self._plan_summary(plan)} if plan else None
+            return {
+                "published": self.published,
+                "delivered": self.delivered,
+                "pending": len(self.pending),
+                "failed": self.failed,
+                "mean_latency_ms": 1000 * self.latency_sum / self.delivered if self.delivered else None,
+                "max_latency_ms": 1000 * self.latency_max,
+                "throughput_per_s": len(self.recent_deliveries) / THROUGHPUT_WINDOW,
+                "pending_per_community": self._pending_per_community(),
+                "plans": {plan_id: self._plan_summary(plan) for plan_id, plan in self.plans.items()}
+            }
+
+    def _pending_per_community(self) -> dict:
+        # Must be called with self.lock held
+        pending = {rec_id: 0 for rec_id in self.windows}
+        for plan in self.plans.values():
+            pending[plan["rec_id"]] += len(plan["pending"])
+        return pending
+
+    @staticmethod
+    def _plan_summary(plan: dict) -> dict:
+        return {"rec_id": plan["rec_id"], **{key: list(plan[key]) for key in ("delivered", "pending", "failed")}}
+
+    def expire_loop(self) -> None:
+        while True:
+            time.sleep(1)
+            self.expire()
+
 class MQTTManager:
     """
     Manages MQTT connection and message publishing.
     """
-    def __init__(self, broker: str, port: int) -> None:
+    def __init__(self, broker: str, port: int, qos: int = MQTT_QOS, max_inflight: int = MAX_INFLIGHT,
+                 delivery_timeout: float = DELIVERY_TIMEOUT, communities: int = 1) -> None:
         self.broker = broker
         self.port = port
+        self.qos = qos
+        self.delivery = DeliveryTracker(max_inflight, delivery_timeout, MAX_TRACKED_PLANS)
+        threading.Thread(target=self.delivery.expire_loop, daemon=True).start()
         self.client = mqtt.Client(client_id="executor")
+        # The client is shared: its limits add up the windows of all the communities
+        self.client.max_inflight_messages_set(max_inflight * communities)
+        # Expired commands stay queued in the client until acknowledged: bound the queue as well,
+        # publishing fails (and the command is counted as failed) while it is full
+        self.client.max_queued_messages_set(max_inflight * communities)
+        self.client.on_publish = self.on_publish
         try:
             self.client.connect(self.broker, self.port)
             self.client.loop_start()
@@ -26,43 +244,64 @@ class MQTTManager:
         except Exception as e:
             print(f"ERROR: Failed to connect to MQTT broker: {e}", flush=True)
 
-    def publish_message(self, topic: str, message: str) -> None:
+    def on_publish(self, client, userdata, mid) -> None:
+        self.delivery.acknowledge(mid)
+
+    def publish_message(self, topic: str, message: str, plan_id: int, rec_id: str = DEFAULT_REC) -> None:
         """
-        Publishes a message to the specified MQTT topic.
+        Publishes a message to the specified MQTT topic and tracks its delivery.
+        Blocks while the inflight window of the community is full.
         """
+        if not self.delivery.acquire(rec_id):
+            self.delivery.fail(plan_id, rec_id, message, "inflight window full", release=False)
+            return
         try:
-            self.client.publish(topic, message)
-            print(f"INFO: Published message {message} to topic {topic}", flush=True)
-            debug_print(f"DEBUG: MQTT publish details - topic: {topic}, message: {message}")
+            info = self.client.publish(topic, message, qos=self.qos)
         except Exception as e:
-            print(f"ERROR: Failed to publish message: {e}", flush=True)
+            self.delivery.fail(plan_id, rec_id, message, str(e))
+            return
+        # With QoS > 0 paho keeps the message and sends it once reconnected
+        if info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and self.qos > 0):
+            # At QoS 0 on_publish fires once the message is written to the socket
+            self.delivery.register(info.mid, plan_id, rec_id, message)
+            print(f"INFO: Published message {message} to topic {topic}", flush=True)
+            debug_print(f"DEBUG: MQTT publish details - topic: {topic}, message: {message}, mid: {info.mid}, qos: {self.qos}")
+        else:
+            self.delivery.fail(plan_id, rec_id, message, mqtt.error_string(info.rc))
 
 class Executor:
     """
     Processes commands received from the planner and uses MQTTManager to publish MQTT messages.
+    There is one executor per community, all sharing the same MQTTManager.
     """
-    def __init__(self, pubsub_manager: MQTTManager) -> None:
+    def __init__(self, pubsub_manager: MQTTManager, config_watcher: ConfigWatcher = None,
+                 rec_id: str = DEFAULT_REC) -> None:
         self.pubsub_manager = pubsub_manager
+        self.config_watcher = config_watcher
+        self.rec_id = rec_id
+        self.activation_topic = namespaced_topic("/consumer/activation", rec_id)
 
-    def process_command(self, member_id: str, consumer: dict) -> None:
+    def process_command(self, member_id: str, consumer: dict, plan_id: int) -> None:
         """
         Processes a command. If the action is 'activate', publishes an activation message.
         :param member_id: ID of the member.
         :param consumer: Consumer dictionary (e.g., {"consumer_id": "consumer1", "action": "activate"}).
+        :param plan_id: ID of the plan the command belongs to, used to track its delivery.
         """
         action = consumer.get("action")
-        if action == "activate":
+        if self.config_watcher is not None and not self.config_watcher.compiled.has_consumer(member_id, consumer.get("consumer_id")):
+            print(f"WARNING: Unknown consumer {consumer.get('consumer_id')} for member {member_id}", flush=True)
+        elif action == "activate":
             print(f"INFO: Activating consumer {consumer.get('consumer_id')} for member {member_id}", flush=True)
             try:
-                topic = "/consumer/activation"
+                topic = self.activation_topic
                 message_payload = {
                     "member_id": member_id,
                     "consumer_id": consumer.get("consumer_id"),
                     "action": "activate"
                 }
                 message = json.dumps(message_payload)
-                self.pubsub_manager.publish_message(topic, message)
-                print(f"INFO: Activation message published: {message}", flush=True)
+                self.pubsub_manager.publish_message(topic, message, plan_id, self.rec_id)
             except Exception as e:
                 print(f"ERROR: Failed to publish activation message: {e}", flush=True)
         else:
@@ -70,28 +309,43 @@ class Executor:
 
 class APIManager:
     """
-    Manages the API endpoints using Bottle and routes commands to the Executor.
+    Manages the API endpoints using Bottle and routes commands to the Executor of their
+    community (routes prefixed with /rec/<rec_id>, or unprefixed for the default community).
     """
-    def __init__(self, executor: Executor) -> None:
-        self.executor = executor
+    def __init__(self, executors: dict, pubsub_manager: MQTTManager) -> None:
+        self.executors = executors
+        self.pubsub_manager = pubsub_manager
         self.app = Bottle()
         self.setup_routes()
+        self.app.mount('/profiling', profiling_app())
 
     def setup_routes(self) -> None:
         @self.app.post('/commands')
-        def receive_commands():
+        @self.app.post('/rec/<rec_id>/commands')
+        def receive_commands(rec_id=DEFAULT_REC):
             """
             Receives commands from the planner and processes them.
             """
+            executor = self.executors.get(rec_id)
+            if executor is None:
+                return HTTPResponse(
+                    body=json.dumps({"error": f"Unknown community {rec_id}"}),
+                    status=404,
+                    headers={"Content-Type": "application/json"}
+                )
             try:
                 data = request.json
-                print(f"INFO: Received commands: {data}", flush=True)
-                # Process each command in the received data
-                for member_id, consumers in data.items():
-                    for consumer in consumers:
-                        self.executor.process_command(member_id, consumer)
+                print(f"INFO: Received commands for community {rec_id}: {data}", flush=True)
+                plan_id = self.pubsub_manager.delivery.new_plan(rec_id)
+                try:
+                    # Process each command in the received data
+                    for member_id, consumers in data.items():
+                        for consumer in consumers:
+                            executor.process_command(member_id, consumer, plan_id)
+                finally:
+                    self.pubsub_manager.delivery.close_plan(plan_id)
                 return HTTPResponse(
-                    body=json.dumps({"status": "success"}),
+                    body=json.dumps({"status": "success", "plan_id": plan_id}),
                     status=200,
                     headers={"Content-Type": "application/json"}
                 )
@@ -103,11 +357,41 @@ class APIManager:
                     headers={"Content-Type": "application/json"}
                 )
 
+        @self.app.get('/status')
+        def delivery_status():
+            """
+            Reports delivery counters and delivered, pending and failed commands per plan.
+            """
+            return HTTPResponse(
+                body=json.dumps(self.pubsub_manager.delivery.status()),
+                status=200,
+                headers={"Content-Type": "application/json"}
+            )
+
+        @self.app.get('/status/<plan_id:int>')
+        def plan_status(plan_id):
+            """
+            Reports delivered, pending and failed commands of a single plan.
+            """
+            status = self.pubsub_manager.delivery.status(plan_id)
+            if status is None:
+                return HTTPResponse(
+                    body=json.dumps({"error": f"Unknown plan {plan_id}"}),
+                    status=404,
+                    headers={"Content-Type": "application/json"}
+                )
+            return HTTPResponse(
+                body=json.dumps(status),
+                status=200,
+                headers={"Content-Type": "application/json"}
+            )
+
     def run(self, host: str = "0.0.0.0", port: int = 8081) -> None:
         """
         Runs the Bottle API server.
+        Multi-threaded, so that a community waiting for its inflight window does not block the others.
         """
-        run(self.app, host=host, port=port)
+        run(self.app, host=host, port=port, server="waitress", threads=API_THREADS)
 
 if __name__ == "__main__":
     # Read MQTT broker configuration from environment variables
@@ -115,9 +399,14 @@ if __name__ == "__main__":
     PORT = int(os.getenv('PORT', 1883))
     
     # Initialize MQTTManager, Executor, and APIManager
-    pubsub_manager = MQTTManager(BROKER, PORT)
-    executor = Executor(pubsub_manager)
-    api_manager = APIManager(executor)
+    communities = discover_communities()
+    pubsub_manager = MQTTManager(BROKER, PORT, communities=len(communities))
+    executors = {}
+    for rec_id, config_path in communities.items():
+        config_watcher = ConfigWatcher(config_path)
+        config_watcher.start()
+        executors[rec_id] = Executor(pubsub_manager, config_watcher, rec_id)
+    api_manager = APIManager(executors, pubsub_manager)
     
     # Run the Bottle API server
     api_manager.run()
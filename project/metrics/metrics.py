@@ -0,0 +1,339 @@
+import json
+import os
+import threading
+import time
+import paho.mqtt.client as mqtt
+from bottle import Bottle, response, run
+from common.profiling import profiling_app
+from common.communities import DEFAULT_REC, community_subscriptions, namespaced_topic, split_topic, tag_line
+
+# Debug mechanism via environment variable
+DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1", "yes")
+
+def debug_print(msg):
+    if DEBUG:
+        print(msg, flush=True)
+
+# MQTT parameters
+BROKER = os.getenv("BROKER", "broker")
+PORT = int(os.getenv("PORT", 1883))
+TAUDELTA_TOPIC = "/consumer/taudelta/+/+"
+BATTERY_TOPIC = "/battery"
+METRICS_TOPIC = "/metrics/goals"
+
+# Rolling window over which the published indices are computed
+WINDOW_SECONDS = int(os.getenv("METRICS_WINDOW_SECONDS", 3600))
+WINDOW_BUCKETS = int(os.getenv("METRICS_WINDOW_BUCKETS", 60))
+PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", 5))
+# Simulated minutes (unit of tau and delta) elapsing per wall-clock second
+SIMULATION_SPEED = float(os.getenv("SIMULATION_SPEED", 1))
+
+# Upper bounds (simulated minutes) of the lateness histogram bins; the last bin is unbounded
+LATENESS_BINS = (1, 5, 10, 15, 30, 60, 120, 240)
+
+# Counters kept per window bucket
+COUNTERS = ("requests", "completed", "on_time", "misses", "lateness_sum", "external_energy",
+            "battery_samples", "stored_energy_sum", "unused_energy_sum", "shortfall_sum")
+
+
+class LineProtocol:
+    """
+    Parses the InfluxDB line protocol messages published by the sensors.
+    """
+    @staticmethod
+    def parse(payload: str) -> tuple:
+        """
+        Returns (measurement, tags, fields, timestamp in ns).
+        """
+        series, fields, timestamp = payload.split(" ")
+        measurement, *tags = series.split(",")
+        tags = dict(tag.split("=", 1) for tag in tags)
+        fields = dict(field.split("=", 1) for field in fields.split(","))
+        return measurement, tags, fields, int(timestamp)
+
+
+class RollingWindow:
+    """
+    Time window made of fixed buckets: adding a value is O(1), and memory does not
+    depend on the number of events. Buckets older than the window are recycled.
+    """
+    def __init__(self, window_seconds: int, buckets: int) -> None:
+        self.bucket_ns = int(window_seconds * 1e9 / buckets)
+        self.buckets = buckets
+        self.epochs = [-1] * buckets
+        self.counters = [dict.fromkeys(COUNTERS, 0) for _ in range(buckets)]
+        self.histograms = [[0] * (len(LATENESS_BINS) + 1) for _ in range(buckets)]
+
+    def _bucket(self, timestamp: int) -> int:
+        epoch = timestamp // self.bucket_ns
+        idx = epoch % self.buckets
+        if self.epochs[idx] != epoch:
+            # The bucket holds data older than the window: reuse it
+            self.epochs[idx] = epoch
+            self.counters[idx] = dict.fromkeys(COUNTERS, 0)
+            self.histograms[idx] = [0] * (len(LATENESS_BINS) + 1)
+        return idx
+
+    def add(self, timestamp: int, counter: str, value: float = 1) -> None:
+        self.counters[self._bucket(timestamp)][counter] += value
+
+    def add_lateness(self, timestamp: int, bin_idx: int) -> None:
+        self.histograms[self._bucket(timestamp)][bin_idx] += 1
+
+    def totals(self, now: int) -> tuple:
+        """
+        Sums the buckets still inside the window ending at now.
+        """
+        current = now // self.bucket_ns
+        counters = dict.fromkeys(COUNTERS, 0)
+        histogram = [0] * (len(LATENESS_BINS) + 1)
+        for idx in range(self.buckets):
+            if current - self.buckets < self.epochs[idx] <= current:
+                for key, value in self.counters[idx].items():
+                    counters[key] += value
+                for bin_idx, count in enumerate(self.histograms[idx]):
+                    histogram[bin_idx] += count
+        return counters, histogram
+
+
+class ConsumerState:
+    """
+    Constant-size state of a consumer: its current request and its energy demand.
+    """
+    __slots__ = ("demand", "requested", "missed_at")
+
+    def __init__(self) -> None:
+        self.demand = 0
+        self.requested = False
+        self.missed_at = None
+
+
+class GoalMetrics:
+    """
+    Computes the README goal indices incrementally from the tau_delta and battery streams:
+      - tau(c) <= delta(c): requests fulfilled before their deadline, misses and lateness;
+      - s - sum(tau * omega) -> 0: stored energy against the pending demand (unused energy
+        when positive, shortfall when negative) and external energy drawn.
+    Every event is processed in O(1).
+    """
+    def __init__(self, window_seconds: int = WINDOW_SECONDS, buckets: int = WINDOW_BUCKETS,
+                 simulation_speed: float = SIMULATION_SPEED) -> None:
+        self.lock = threading.Lock()
+        self.simulation_speed = simulation_speed
+        self.window_seconds = window_seconds
+        self.window = RollingWindow(window_seconds, buckets)
+        self.consumers = {}
+        self.demand = 0
+        self.stored_energy = 0
+        self.last_timestamp = 0
+        self.lifetime = dict.fromkeys(COUNTERS, 0)
+        self.lifetime_histogram = [0] * (len(LATENESS_BINS) + 1)
+
+    def _count(self, timestamp: int, counter: str, value: float = 1) -> None:
+        self.window.add(timestamp, counter, value)
+        self.lifetime[counter] += value
+
+    def on_tau_delta(self, member_id: str, consumer_id: str, tau: float, delta: float,
+                     cons: float, timestamp: int) -> None:
+        with self.lock:
+            self.last_timestamp = max(self.last_timestamp, timestamp)
+            state = self.consumers.get((member_id, consumer_id))
+            if state is None:
+                state = self.consumers[(member_id, consumer_id)] = ConsumerState()
+
+            # Pending demand in kWh: tau is in minutes and cons in kW
+            demand = tau / 60 * cons
+            self.demand += demand - state.demand
+            state.demand = demand
+
+            if tau > 0 and not state.requested:
+                state.requested = True
+                state.missed_at = None
+                self._count(timestamp, "requests")
+            elif state.requested and tau > 0 and delta <= 0 and state.missed_at is None:
+                # The deadline has passed with part of tau still to be served
+                state.missed_at = timestamp
+                self._count(timestamp, "misses")
+            elif state.requested and tau <= 0:
+                state.requested = False
+                self._count(timestamp, "completed")
+                if state.missed_at is None:
+                    self._count(timestamp, "on_time")
+                else:
+                    lateness = (timestamp - state.missed_at) / 1e9 * self.simulation_speed
+                    self._count(timestamp, "lateness_sum", lateness)
+                    bin_idx = next((i for i, bound in enumerate(LATENESS_BINS) if lateness <= bound), len(LATENESS_BINS))
+                    self.window.add_lateness(timestamp, bin_idx)
+                    self.lifetime_histogram[bin_idx] += 1
+
+    def on_battery(self, value: float, non_battery_consumption: float, timestamp: int) -> None:
+        with self.lock:
+            self.last_timestamp = max(self.last_timestamp, timestamp)
+            self.stored_energy = value
+            gap = value - self.demand
+            self._count(timestamp, "external_energy", non_battery_consumption)
+            self._count(timestamp, "battery_samples")
+            self._count(timestamp, "stored_energy_sum", value)
+            self._count(timestamp, "unused_energy_sum", max(gap, 0))
+            self._count(timestamp, "shortfall_sum", max(-gap, 0))
+
+    @staticmethod
+    def _indices(counters: dict, histogram: list) -> dict:
+        late = sum(histogram)
+        samples = counters["battery_samples"] or 1
+        return {
+            "requests": counters["requests"],
+            "completed": counters["completed"],
+            "on_time": counters["on_time"],
+            "deadline_misses": counters["misses"],
+            "satisfaction_rate": counters["on_time"] / counters["completed"] if counters["completed"] else 1.0,
+            "mean_lateness": counters["lateness_sum"] / late if late else 0.0,
+            "lateness_histogram": {f"<={bound}" if i < len(LATENESS_BINS) else f">{LATENESS_BINS[-1]}": count
+                                   for i, (bound, count) in enumerate(zip(LATENESS_BINS + (None,), histogram))},
+            "external_energy": counters["external_energy"],
+            "mean_stored_energy": counters["stored_energy_sum"] / samples,
+            "mean_unused_energy": counters["unused_energy_sum"] / samples,
+            "mean_shortfall": counters["shortfall_sum"] / samples,
+        }
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            window, histogram = self.window.totals(self.last_timestamp)
+            return {
+                "timestamp": self.last_timestamp,
+                "window_seconds": self.window_seconds,
+                "stored_energy": self.stored_energy,
+                "pending_demand": self.demand,
+                "goal_gap": self.stored_energy - self.demand,
+                "window": self._indices(window, histogram),
+                "lifetime": self._indices(self.lifetime, self.lifetime_histogram),
+            }
+
+    @staticmethod
+    def to_line_protocol(snapshot: dict) -> str:
+        window = snapshot["window"]
+        fields = {
+            "stored_energy": snapshot["stored_energy"],
+            "pending_demand": snapshot["pending_demand"],
+            "goal_gap": snapshot["goal_gap"],
+            **{key: value for key, value in window.items() if key != "lateness_histogram"},
+        }
+        fields = ",".join(f"{key}={value}" for key, value in fields.items())
+        return f"goal_metrics,window={snapshot['window_seconds']}s {fields} {snapshot['timestamp']}"
+
+
+class CommunityMetrics:
+    """
+    Goal metrics of every community, created when the first message of a community arrives.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.communities = {}
+
+    def get(self, rec_id: str) -> GoalMetrics:
+        with self.lock:
+            metrics = self.communities.get(rec_id)
+            if metrics is None:
+                metrics = self.communities[rec_id] = GoalMetrics()
+            return metrics
+
+    def items(self) -> list:
+        with self.lock:
+            return list(self.communities.items())
+
+
+class MQTTManager:
+    """
+    Subscribes to the tau_delta and battery streams of every community, feeds the metrics
+    of the community and publishes their results.
+    """
+    def __init__(self, broker: str, port: int, metrics: CommunityMetrics) -> None:
+        self.broker = broker
+        self.port = port
+        self.metrics = metrics
+        self.client = mqtt.Client(client_id="metrics")
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+
+    def on_connect(self, client, userdata, flags, rc) -> None:
+        if rc == 0:
+            print(f"INFO: Connected to MQTT broker {self.broker}:{self.port}", flush=True)
+            client.subscribe([(topic, 0) for topic in community_subscriptions(TAUDELTA_TOPIC) + community_subscriptions(BATTERY_TOPIC)])
+        else:
+            print(f"ERROR: Connection failed with result code {rc}", flush=True)
+
+    def on_message(self, client, userdata, message) -> None:
+        rec_id, _ = split_topic(message.topic)
+        try:
+            measurement, tags, fields, timestamp = LineProtocol.parse(message.payload.decode("utf-8"))
+            metrics = self.metrics.get(rec_id)
+            if measurement == "tau_delta":
+                metrics.on_tau_delta(tags["member_id"], tags["consumer_id"], float(fields["tau"]),
+                                          float(fields["delta"]), float(tags["cons"]), timestamp)
+            elif measurement == "battery":
+                metrics.on_battery(float(fields["value"]), float(fields["non_battery_consumption"]), timestamp)
+        except (ValueError, KeyError) as e:
+            print(f"ERROR: Invalid message on {message.topic}: {e}", flush=True)
+
+    def publish(self, message: str, rec_id: str = DEFAULT_REC) -> None:
+        topic = namespaced_topic(METRICS_TOPIC, rec_id)
+        message = tag_line(message, rec_id)
+        debug_print(f"DEBUG: Publishing on {topic}: {message}")
+        self.client.publish(topic, message)
+
+    def start(self) -> None:
+        self.client.connect(self.broker, self.port)
+        self.client.loop_start()
+
+
+class APIManager:
+    """
+    Exposes the latest goal indices of each community.
+    """
+    def __init__(self, metrics: CommunityMetrics) -> None:
+        self.metrics = metrics
+        self.app = Bottle()
+        self.setup_routes()
+        self.app.mount('/profiling', profiling_app())
+
+    def setup_routes(self) -> None:
+        @self.app.get('/metrics')
+        @self.app.get('/rec/<rec_id>/metrics')
+        def get_metrics(rec_id=DEFAULT_REC):
+            response.content_type = 'application/json'
+            if rec_id not in self.metrics.communities:
+                response.status = 404
+                return json.dumps({"status": "error", "message": f"No metrics for community {rec_id}"})
+            return json.dumps(self.metrics.get(rec_id).snapshot())
+
+        @self.app.get('/communities')
+        def get_communities():
+            response.content_type = 'application/json'
+            return json.dumps(sorted(rec_id for rec_id, _ in self.metrics.items()))
+
+        @self.app.get('/health')
+        def health():
+            response.content_type = 'application/json'
+            return json.dumps({"status": "ok"})
+
+    def run(self) -> None:
+        run(self.app, host="0.0.0.0", port=8083)
+
+
+if __name__ == '__main__':
+    metrics = CommunityMetrics()
+    mqtt_manager = MQTTManager(BROKER, PORT, metrics)
+    mqtt_manager.start()
+
+    api_manager = APIManager(metrics)
+    api_thread = threading.Thread(target=api_manager.run)
+    api_thread.daemon = True
+    api_thread.start()
+
+    # Publish the rolling-window indices periodically
+    while True:
+        time.sleep(PUBLISH_INTERVAL)
+        for rec_id, community_metrics in metrics.items():
+            snapshot = community_metrics.snapshot()
+            if snapshot["timestamp"]:
+                mqtt_manager.publish(GoalMetrics.to_line_protocol(snapshot), rec_id)
@@ -1,7 +1,14 @@
 import json
 import os
+import queue
+import threading
+import time
 from bottle import Bottle, request, run, HTTPResponse
 import requests
+from common.rec_config import ConfigWatcher
+from common.profiling import hot_path, profiling_app
+from common.communities import COMMUNITY_WORKERS, DEFAULT_REC, discover_communities, namespaced_route
+from common.run_export import RunExporter, create_exporter
 
 # Debug mechanism based on environment variable
 DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1", "yes")
@@ -12,6 +19,61 @@ def debug_print(msg):
 
 # Executor API configuration using environment variable
 EXECUTOR_API = os.getenv("EXECUTOR_API", "http://executor:8081")
+# Seconds to wait for the executor: a dispatch not answered in time counts as failed,
+# and the dispatching thread moves on to the next plan
+EXECUTOR_TIMEOUT = float(os.getenv("EXECUTOR_TIMEOUT", 5))
+# Number of threads serving the planner API
+API_THREADS = int(os.getenv("API_THREADS", 8))
+
+# Table of the columnar run export (RUN_EXPORT_DIR): one row per activable consumer of each
+# planned snapshot, joined with the analyzer decisions on (rec_id, snapshot_id)
+EXPORT_SCHEMAS = {
+    "planner_decisions": [("snapshot_id", "int64"), ("member_id", "string"), ("consumer_id", "string"),
+                          ("tau", "float64"), ("delta", "float64"), ("cons_required", "float64"),
+                          ("battery", "float64"), ("urgent", "bool"), ("chosen", "bool")],
+}
+
+
+class LatestWinsQueue:
+    """
+    Single-slot queue: putting an item replaces the one still waiting,
+    so the consumer always gets the freshest snapshot.
+    """
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.item = None
+        self.has_item = False
+        self.received = 0
+        self.coalesced = 0
+
+    def put(self, item) -> bool:
+        """
+        Stores the item and returns True if it replaced an item not yet consumed.
+        """
+        with self.condition:
+            replaced = self.has_item
+            self.item = item
+            self.has_item = True
+            self.received += 1
+            if replaced:
+                self.coalesced += 1
+            self.condition.notify()
+            return replaced
+
+    def get(self, block: bool = True):
+        """
+        Returns the waiting item, blocking until one is available
+        (or returning None right away when block is False).
+        """
+        with self.condition:
+            while not self.has_item:
+                if not block:
+                    return None
+                self.condition.wait()
+            item = self.item
+            self.item = None
+            self.has_item = False
+            return item
 
 class Planner:
     """
@@ -19,9 +81,30 @@ class Planner:
     based on battery level, urgency, and other constraints,
     and sends commands to the Executor API.
     """
-    def __init__(self, executor_api: str):
+    def __init__(self, executor_api: str, config_watcher: ConfigWatcher = None, rec_id: str = DEFAULT_REC,
+                 exporter: RunExporter = None, timeout: float = EXECUTOR_TIMEOUT):
         self.executor_api = executor_api
+        self.timeout = timeout
+        self.config_watcher = config_watcher
+        self.rec_id = rec_id
+        self.exporter = exporter
+        # Called with the rec_id when the community has to be planned / dispatched by the shared threads
+        self.on_ready = None
+        self.on_dispatch_ready = None
+        # Analyzer snapshots waiting to be planned (only the latest is kept)
+        self.requests = LatestWinsQueue()
+        # Plan waiting to be sent to the executor (a newer plan replaces the waiting one)
+        self.dispatch_slot = LatestWinsQueue()
+        # A community is planned and dispatched by one thread at a time, so plans are
+        # computed from the latest snapshot and sent to the executor in order
+        self.lock = threading.Lock()
+        self.planning = False
+        self.dispatching = False
+        self.planned = 0
+        self.dispatched = 0
+        self.failed_dispatches = 0
 
+    @hot_path
     def choose_consumers(self, data: dict) -> dict:
         """
         Determines which consumers to activate based on:
@@ -36,6 +119,11 @@ class Planner:
         activable = {}
 
         for member_id, consumers in members.items():
+            # Skip consumers removed from the REC configuration since the analyzer snapshot
+            if self.config_watcher is not None:
+                compiled = self.config_watcher.compiled
+                consumers = [c for c in consumers if compiled.has_consumer(member_id, c["consumer_id"])]
+
             # Separate urgent consumers from non-urgent consumers
             urgent_consumers = [consumer for consumer in consumers if consumer.get('isUrgent')]
             non_urgent_consumers = [consumer for consumer in consumers if not consumer.get('isUrgent')]
@@ -67,59 +155,204 @@ class Planner:
         debug_print(f"DEBUG: Activable consumers determined: {activable}")
         return activable
 
-    def send_to_executor(self, activable_consumers: dict) -> None:
+    def send_to_executor(self, activable_consumers: dict) -> bool:
         """
         Sends the activable consumers to the Executor via an HTTP request.
         :param activable_consumers: Dictionary of activable consumers grouped by member.
+        :return: False if the executor did not accept the commands in time.
         """
-        url = f"{self.executor_api}/commands"
+        url = f"{self.executor_api}{namespaced_route('/commands', self.rec_id)}"
         headers = {'Content-Type': 'application/json'}
         try:
-            response = requests.post(url, headers=headers, json=activable_consumers)
-            if response.status_code == 200:
-                print("INFO: Commands successfully sent to the executor.", flush=True)
-            else:
-                print(f"ERROR: Failed to send commands to the executor. Status code: {response.status_code}", flush=True)
+            response = requests.post(url, headers=headers, json=activable_consumers, timeout=self.timeout)
         except Exception as e:
             print(f"ERROR: Error sending commands to the executor: {e}", flush=True)
+            return False
+        if response.status_code == 200:
+            print("INFO: Commands successfully sent to the executor.", flush=True)
+            return True
+        print(f"ERROR: Failed to send commands to the executor. Status code: {response.status_code}", flush=True)
+        return False
 
     def process_request(self, data: dict) -> (int, dict):
         """
-        Processes the incoming request, validates the data,
-        determines the activable consumers, and sends the commands.
+        Validates the incoming request and queues it for planning.
+        A request still waiting to be planned is superseded by the new one.
         :param data: JSON data from the request.
         :return: A tuple (status_code, response_body).
         """
-        print(f"INFO: Received activable consumers request: {data}", flush=True)
+        debug_print(f"DEBUG: Received activable consumers request: {data}")
 
         # Validate incoming data
         if not data or 'members' not in data or 'battery' not in data:
             return 400, {"error": "Invalid input data"}
 
-        activable = self.choose_consumers(data)
+        superseded = self.requests.put(data)
+        if self.on_ready is not None and self.claim_planning():
+            self.on_ready(self.rec_id)
+        return 202, {"status": "accepted", "superseded": superseded}
 
+    def plan(self, data: dict) -> dict:
+        """
+        Plans an analyzer snapshot. Returns the plan, or None if nothing has to be activated.
+        """
+        try:
+            activable = self.choose_consumers(data)
+        except Exception as e:
+            print(f"ERROR: Error planning request of community {self.rec_id}: {e}", flush=True)
+            return None
+        self.planned += 1
+        if self.exporter is not None:
+            self.export_decisions(data, activable)
         if any(activable.values()):
-            self.send_to_executor(activable)
-            return 200, {"status": "success", "activable": activable}
-        else:
-            return 200, {"status": "no consumers activated"}
+            print(f"INFO: Planned activations of community {self.rec_id}: {activable}", flush=True)
+            return activable
+        debug_print("DEBUG: No consumers activated")
+        return None
+
+    def export_decisions(self, data: dict, activable: dict) -> None:
+        """
+        Records every consumer of the snapshot and whether the plan chose it.
+        """
+        timestamp = time.time_ns()
+        chosen = {(member_id, command["consumer_id"]) for member_id, commands in activable.items() for command in commands}
+        for member_id, consumers in data["members"].items():
+            for consumer in consumers:
+                self.exporter.write("planner_decisions", self.rec_id, timestamp, snapshot_id=data.get("snapshot_id"),
+                                    member_id=member_id, consumer_id=consumer["consumer_id"], tau=consumer["tau"],
+                                    delta=consumer["delta"], cons_required=consumer["cons_required"],
+                                    battery=data["battery"], urgent=bool(consumer.get("isUrgent")),
+                                    chosen=(member_id, consumer["consumer_id"]) in chosen)
+
+    def claim_planning(self) -> bool:
+        """
+        Marks the community as being planned, if a snapshot is waiting and no thread is planning it.
+        """
+        with self.lock:
+            if self.planning or not self.requests.has_item:
+                return False
+            self.planning = True
+            return True
+
+    def claim_dispatch(self) -> bool:
+        """
+        Marks the community as being dispatched, if a plan is waiting and no thread is sending one.
+        """
+        with self.lock:
+            if self.dispatching or not self.dispatch_slot.has_item:
+                return False
+            self.dispatching = True
+            return True
+
+    def plan_next(self) -> None:
+        """
+        Plans the waiting snapshot and hands the plan over to the dispatcher. The community is
+        queued again only if a newer snapshot arrived while planning.
+        """
+        try:
+            data = self.requests.get(block=False)
+            activable = self.plan(data) if data is not None else None
+            if activable is not None:
+                self.dispatch_slot.put(activable)
+                if self.claim_dispatch():
+                    self.on_dispatch_ready(self.rec_id)
+        finally:
+            with self.lock:
+                self.planning = False
+            if self.claim_planning():
+                self.on_ready(self.rec_id)
+
+    def dispatch_next(self) -> None:
+        """
+        Sends the waiting plan to the executor, outside of the request path. The community is
+        queued again only if a newer plan arrived while sending.
+        """
+        try:
+            activable = self.dispatch_slot.get(block=False)
+            if activable is not None:
+                if self.send_to_executor(activable):
+                    self.dispatched += 1
+                else:
+                    self.failed_dispatches += 1
+        finally:
+            with self.lock:
+                self.dispatching = False
+            if self.claim_dispatch():
+                self.on_dispatch_ready(self.rec_id)
+
+    def status(self) -> dict:
+        return {
+            "received": self.requests.received,
+            "coalesced": self.requests.coalesced,
+            "planned": self.planned,
+            "pending_dispatch": int(self.dispatch_slot.has_item),
+            "superseded_plans": self.dispatch_slot.coalesced,
+            "dispatched": self.dispatched,
+            "failed_dispatches": self.failed_dispatches,
+            "planning": self.planning,
+            "dispatching": self.dispatching
+        }
+
+class CommunityPlanners:
+    """
+    Planners of all the communities, served by planning and dispatching threads shared by all of them.
+    A community is queued only when it has work and no thread is already handling it (newer
+    snapshots and plans replace the waiting ones), so communities are served in FIFO order,
+    a community sending many snapshots cannot delay the others, and the plans of a
+    community reach the executor one at a time, the latest last.
+    """
+    def __init__(self, planners: dict, workers: int = COMMUNITY_WORKERS):
+        self.planners = planners
+        self.workers = workers
+        # rec_ids of the communities waiting to be planned / dispatched
+        self.ready = queue.Queue()
+        self.dispatch_ready = queue.Queue()
+        for planner in planners.values():
+            planner.on_ready = self.ready.put
+            planner.on_dispatch_ready = self.dispatch_ready.put
+
+    def plan_worker(self) -> None:
+        while True:
+            self.planners[self.ready.get()].plan_next()
+
+    def dispatch_worker(self) -> None:
+        while True:
+            self.planners[self.dispatch_ready.get()].dispatch_next()
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            threading.Thread(target=self.plan_worker, daemon=True).start()
+            threading.Thread(target=self.dispatch_worker, daemon=True).start()
+
+    def status(self) -> dict:
+        return {
+            "communities": {rec_id: planner.status() for rec_id, planner in self.planners.items()},
+            "pending_planning": self.ready.qsize(),
+            "pending_dispatch": self.dispatch_ready.qsize()
+        }
 
 class APIManager:
     """
     Manages the API exposed via Bottle.
-    Configures routes and forwards requests to the Planner.
+    Configures routes and forwards requests to the Planner of their community
+    (routes prefixed with /rec/<rec_id>, or unprefixed for the default community).
     """
-    def __init__(self, planner: Planner):
-        self.planner = planner
+    def __init__(self, planners: CommunityPlanners):
+        self.planners = planners
         self.app = Bottle()
         self.setup_routes()
+        self.app.mount('/profiling', profiling_app())
 
     def setup_routes(self) -> None:
         @self.app.post('/activable_consumers')
-        def activable_consumers():
+        @self.app.post('/rec/<rec_id>/activable_consumers')
+        def activable_consumers(rec_id=DEFAULT_REC):
+            planner = self.planners.planners.get(rec_id)
+            if planner is None:
+                return self.unknown_community(rec_id)
             try:
                 data = request.json
-                status_code, response_body = self.planner.process_request(data)
+                status_code, response_body = planner.process_request(data)
                 return HTTPResponse(
                     body=json.dumps(response_body),
                     status=status_code,
@@ -133,10 +366,45 @@ class APIManager:
                     headers={"Content-Type": "application/json"}
                 )
 
+        @self.app.get('/status')
+        def status():
+            return HTTPResponse(
+                body=json.dumps(self.planners.status()),
+                status=200,
+                headers={"Content-Type": "application/json"}
+            )
+
+        @self.app.get('/rec/<rec_id>/status')
+        def community_status(rec_id):
+            planner = self.planners.planners.get(rec_id)
+            if planner is None:
+                return self.unknown_community(rec_id)
+            return HTTPResponse(
+                body=json.dumps(planner.status()),
+                status=200,
+                headers={"Content-Type": "application/json"}
+            )
+
+    @staticmethod
+    def unknown_community(rec_id: str) -> HTTPResponse:
+        return HTTPResponse(
+            body=json.dumps({"error": f"Unknown community {rec_id}"}),
+            status=404,
+            headers={"Content-Type": "application/json"}
+        )
+
     def run(self) -> None:
-        run(self.app, host="0.0.0.0", port=8080)
+        # Multi-threaded server, so that requests are accepted while a plan is being computed
+        run(self.app, host="0.0.0.0", port=8080, server="waitress", threads=API_THREADS)
 
 if __name__ == "__main__":
-    planner = Planner(EXECUTOR_API)
-    api_manager = APIManager(planner)
+    planners = {}
+    exporter = create_exporter(EXPORT_SCHEMAS)
+    for rec_id, config_path in discover_communities().items():
+        config_watcher = ConfigWatcher(config_path)
+        config_watcher.start()
+        planners[rec_id] = Planner(EXECUTOR_API, config_watcher, rec_id, exporter)
+    community_planners = CommunityPlanners(planners)
+    community_planners.start()
+    api_manager = APIManager(community_planners)
     api_manager.run()
@@ -1,11 +1,22 @@
+import copy
+import math
 import random
 import json
 import time
 import threading
+import queue
+import atexit
 from bottle import Bottle, request, response, run
 import os
+import numpy as np
 import pandas as pd
 import paho.mqtt.client as mqtt
+from influxdb_client import InfluxDBClient, WriteOptions
+from common.rec_config import ConfigWatcher, CompiledREC, ConfigDelta
+from traces import TraceReplay
+from common.profiling import hot_path, profiling_app
+from common.communities import DEFAULT_REC, FairScheduler, discover_communities, namespaced_topic, tag_line
+from common.run_export import RunExporter, create_exporter
 
 # Debug mechanism via environment variable
 DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1", "yes")
@@ -29,24 +40,80 @@ HOURS_IN_A_SIMULATION_STEP = MINUTES_IN_A_SIMULATION_STEP / 60
 
 TAU_DELTA_INTERVAL_BOUNDS = tuple(map(int, os.getenv("TAU_DELTA_INTERVAL_BOUNDS", "60,90").split(',')))
 
+# Optional production trace (.npy) replayed instead of random production
+PRODUCTION_TRACE = os.getenv("PRODUCTION_TRACE", None)
+
+# Telemetry sinks per measurement: "mqtt" (through Telegraf), "direct" (batched writes to InfluxDB)
+# or "both" (direct writes, MQTT kept for live subscribers). Measurements not listed go to MQTT.
+TELEMETRY_MEASUREMENTS = ("production", "tau_delta", "battery")
+TELEMETRY_SINK_TYPES = ("mqtt", "direct", "both")
+
+
+def parse_telemetry_sinks(value: str) -> dict:
+    """
+    Parses "measurement=sink,..." into the sink of every measurement.
+    """
+    sinks = dict.fromkeys(TELEMETRY_MEASUREMENTS, "mqtt")
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        measurement, _, sink = (part.strip() for part in item.partition("="))
+        if measurement not in TELEMETRY_MEASUREMENTS:
+            raise ValueError(f"Invalid TELEMETRY_SINKS entry {item!r}: unknown measurement {measurement!r}, "
+                             f"expected one of {', '.join(TELEMETRY_MEASUREMENTS)}")
+        if sink not in TELEMETRY_SINK_TYPES:
+            raise ValueError(f"Invalid TELEMETRY_SINKS entry {item!r}: sink must be one of "
+                             f"{', '.join(TELEMETRY_SINK_TYPES)}")
+        sinks[measurement] = sink
+    return sinks
+
+
+TELEMETRY_SINKS = parse_telemetry_sinks(os.getenv("TELEMETRY_SINKS", "production=mqtt,tau_delta=mqtt,battery=mqtt"))
+# Tag of the MQTT messages of "both" measurements, dropped by Telegraf (tagdrop) so they are not written twice
+LIVE_TAG = "sink=live"
+INFLUXDB_URL = os.getenv("INFLUXDB_URL", "http://knowledge:8086")
+INFLUXDB_TOKEN = os.getenv("INFLUXDB_TOKEN", "token")
+INFLUXDB_ORG = os.getenv("INFLUXDB_ORG", "RECAM")
+INFLUXDB_BUCKET = os.getenv("INFLUXDB_BUCKET", "RECAM")
+INFLUXDB_BATCH_SIZE = int(os.getenv("INFLUXDB_BATCH_SIZE", 1000))
+INFLUXDB_FLUSH_INTERVAL = int(os.getenv("INFLUXDB_FLUSH_INTERVAL", 200))  # milliseconds
+INFLUXDB_MAX_BUFFER = int(os.getenv("INFLUXDB_MAX_BUFFER", 100000))  # points
+INFLUXDB_MAX_RETRIES = int(os.getenv("INFLUXDB_MAX_RETRIES", 5))
+INFLUXDB_RETRY_INTERVAL = int(os.getenv("INFLUXDB_RETRY_INTERVAL", 1000))  # milliseconds, doubled at each retry
+
+# Tables of the columnar run export (RUN_EXPORT_DIR), mirroring the telemetry measurements
+EXPORT_SCHEMAS = {
+    "production": [("member_id", "string"), ("producer_id", "string"), ("value", "float64")],
+    "tau_delta": [("member_id", "string"), ("consumer_id", "string"), ("cons", "float64"),
+                  ("tau", "float64"), ("delta", "float64"), ("active", "bool")],
+    "battery": [("max_value", "float64"), ("value", "float64"), ("battery_consumption", "float64"),
+                ("non_battery_consumption", "float64")],
+}
+
+# Number of threads serving the sensors API
+API_THREADS = int(os.getenv("API_THREADS", 8))
+
 class Utils:
     @staticmethod
-    def load_sensor_config() -> tuple:
+    def new_consumer_state(cons: float) -> dict:
+        """
+        Returns the initial state of a consumer: no tau/delta assigned and not activated.
+        """
+        return {"cons": cons, "tau": 0, "delta": 0, "activated": False}
+
+    @staticmethod
+    def load_sensor_config(compiled: CompiledREC) -> tuple:
         """
-        Loads sensor configuration from the JSON file.
+        Builds the sensor state from the compiled REC configuration.
         Initializes tau, delta and activation status for each consumer.
         """
-        with open('config/REC.json', 'r') as file:
-            config = json.load(file)
-            
-        # Initialize tau and delta for each consumer
-        for member in config["members"]:
-            for consumer_id in config["members"][member]["consumers"]:
-                config["members"][member]["consumers"][consumer_id]["tau"] = 0
-                config["members"][member]["consumers"][consumer_id]["delta"] = 0
-                config["members"][member]["consumers"][consumer_id]["activated"] = False
-                
-        return config["members"], config["battery"]
+        members = compiled.to_members()
+        for member_id, member_data in members.items():
+            for producer_id, producer_data in member_data["producers"].items():
+                # Dense id of the producer, indexing the trace columns
+                producer_data["idx"] = compiled.producer_index[(member_id, producer_id)]
+            for consumer_id, consumer_data in member_data["consumers"].items():
+                member_data["consumers"][consumer_id] = Utils.new_consumer_state(consumer_data["cons"])
+
+        return members, dict(compiled.battery)
 
     @staticmethod
     def print_members_in_table(members: dict):
@@ -83,14 +150,35 @@ class Utils:
         df = pd.DataFrame(data)
         print(df.to_string(index=False), flush=True)
 
+class LineProtocol:
+    """
+    Formats the telemetry as InfluxDB line protocol, shared by the MQTT and the direct sinks.
+    """
+    @staticmethod
+    def production(member_id, prod_id, production, timestamp) -> str:
+        return f"production,producer_id={prod_id},member_id={member_id} value={production} {timestamp}"
+
+    @staticmethod
+    def tau_delta(cons_id, member_id, tau, delta, cons, activated, timestamp) -> str:
+        return f"tau_delta,consumer_id={cons_id},member_id={member_id},cons={cons} active={activated},tau={tau},delta={delta} {timestamp}"
+
+    @staticmethod
+    def battery(max_battery, battery_value, battery_consumption, non_battery_consumption, timestamp) -> str:
+        return f"battery,max_value={max_battery} battery_consumption={battery_consumption},non_battery_consumption={non_battery_consumption},value={battery_value} {timestamp}"
+
 class MQTTManager:
     """
     Handles MQTT connection and message publishing.
+    Messages of a community other than the default one are published on its
+    namespaced topics and tagged with its rec_id.
     """
     def __init__(self, broker: str, port: int, prod_topic_structure: str,
                  taudelta_topic_structure: str, battery_topic_structure: str) -> None:
         self.broker = broker
         self.port = port
+        self.rec_id = DEFAULT_REC
+        # Measurements also written directly to InfluxDB: their messages are tagged with LIVE_TAG
+        self.live_only = frozenset()
         self.prod_topic_structure = prod_topic_structure
         self.taudelta_topic_structure = taudelta_topic_structure
         self.battery_topic_structure = battery_topic_structure
@@ -103,45 +191,199 @@ class MQTTManager:
             print(f"ERROR: Failed to connect to MQTT broker: {e}", flush=True)
             raise
 
+    def for_community(self, rec_id: str) -> "MQTTManager":
+        """
+        Returns a manager publishing for another community over the same connection.
+        """
+        manager = copy.copy(self)
+        manager.rec_id = rec_id
+        manager.prod_topic_structure = namespaced_topic(self.prod_topic_structure, rec_id)
+        manager.taudelta_topic_structure = namespaced_topic(self.taudelta_topic_structure, rec_id)
+        manager.battery_topic_structure = namespaced_topic(self.battery_topic_structure, rec_id)
+        return manager
+
+    def message(self, measurement: str, line: str) -> str:
+        line = tag_line(line, self.rec_id)
+        if measurement in self.live_only:
+            series, sep, rest = line.partition(" ")
+            line = f"{series},{LIVE_TAG}{sep}{rest}"
+        return line
+
     def publish_production(self, member_id, prod_id, production, timestamp) -> None:
         topic = self.prod_topic_structure.format(member_id=member_id, prod_id=prod_id)
-        message = f"production,producer_id={prod_id},member_id={member_id} value={production} {timestamp}"
+        message = self.message("production", LineProtocol.production(member_id, prod_id, production, timestamp))
         debug_print(f"DEBUG: Publishing on {topic}: {message}")
         self.client.publish(topic, message)
 
     def publish_tau_delta(self, cons_id, member_id, tau, delta, cons, activated, timestamp) -> None:
         topic = self.taudelta_topic_structure.format(member_id=member_id, cons_id=cons_id)
-        message = f"tau_delta,consumer_id={cons_id},member_id={member_id},cons={cons} active={activated},tau={tau},delta={delta} {timestamp}"
+        message = self.message("tau_delta", LineProtocol.tau_delta(cons_id, member_id, tau, delta, cons, activated, timestamp))
         debug_print(f"DEBUG: Publishing on {topic}: {message}")
         self.client.publish(topic, message)
 
     def publish_battery(self, max_battery, battery_value, battery_consumption, non_battery_consumption, timestamp) -> None:
         topic = self.battery_topic_structure
-        message = f"battery,max_value={max_battery} battery_consumption={battery_consumption},non_battery_consumption={non_battery_consumption},value={battery_value} {timestamp}"
+        message = self.message("battery", LineProtocol.battery(max_battery, battery_value, battery_consumption, non_battery_consumption, timestamp))
         debug_print(f"DEBUG: Publishing on {topic}: {message}")
         self.client.publish(topic, message)
 
+class InfluxWriter:
+    """
+    Writes line protocol records straight to InfluxDB with the client's batching write API
+    (gzip, batch size, flush interval, retries with exponential backoff).
+    Records not yet acknowledged are bounded: once the buffer is full new records are dropped.
+    """
+    def __init__(self, url: str, token: str, org: str, bucket: str, batch_size: int = INFLUXDB_BATCH_SIZE,
+                 flush_interval: int = INFLUXDB_FLUSH_INTERVAL, max_buffer: int = INFLUXDB_MAX_BUFFER,
+                 max_retries: int = INFLUXDB_MAX_RETRIES, retry_interval: int = INFLUXDB_RETRY_INTERVAL) -> None:
+        self.bucket = bucket
+        self.org = org
+        self.max_buffer = max_buffer
+        self.lock = threading.Lock()
+        self.buffered = 0
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.client = InfluxDBClient(url=url, token=token, org=org, enable_gzip=True)
+        self.write_api = self.client.write_api(
+            write_options=WriteOptions(batch_size=batch_size, flush_interval=flush_interval,
+                                       max_retries=max_retries, retry_interval=retry_interval,
+                                       exponential_base=2),
+            success_callback=self.on_success,
+            error_callback=self.on_error,
+            retry_callback=self.on_retry
+        )
+        print(f"INFO: Writing telemetry directly to InfluxDB {url}", flush=True)
+
+    @staticmethod
+    def count_records(data) -> int:
+        return data.count(b"\n" if isinstance(data, bytes) else "\n") + 1
+
+    def on_success(self, conf, data) -> None:
+        records = self.count_records(data)
+        with self.lock:
+            self.buffered -= records
+            self.written += records
+
+    def on_error(self, conf, data, exception) -> None:
+        records = self.count_records(data)
+        with self.lock:
+            self.buffered -= records
+            self.failed += records
+        print(f"ERROR: Failed to write {records} records to InfluxDB: {exception}", flush=True)
+
+    def on_retry(self, conf, data, exception) -> None:
+        with self.lock:
+            self.retries += 1
+        debug_print(f"DEBUG: Retrying InfluxDB write: {exception}")
+
+    def write(self, record: str) -> None:
+        with self.lock:
+            if self.buffered >= self.max_buffer:
+                self.dropped += 1
+                return
+            self.buffered += 1
+        self.write_api.write(bucket=self.bucket, org=self.org, record=record, write_precision="ns")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"buffered": self.buffered, "written": self.written, "failed": self.failed,
+                    "dropped": self.dropped, "retries": self.retries}
+
+    def close(self) -> None:
+        self.write_api.close()
+        self.client.close()
+
+class TelemetryRouter:
+    """
+    Sends each measurement to its configured sinks: MQTT (Telegraf path), direct InfluxDB writes, or both.
+    When an exporter is given, every measurement is also written to the columnar run export.
+    Exposes the same interface as MQTTManager.
+    """
+    def __init__(self, mqtt_manager: MQTTManager, influx_writer: InfluxWriter, sinks: dict,
+                 rec_id: str = DEFAULT_REC, exporter: RunExporter = None) -> None:
+        self.mqtt_manager = mqtt_manager
+        self.influx_writer = influx_writer
+        self.sinks = sinks = {**dict.fromkeys(TELEMETRY_MEASUREMENTS, "mqtt"), **sinks}
+        self.rec_id = rec_id
+        self.exporter = exporter
+        for measurement, sink in sinks.items():
+            if measurement not in TELEMETRY_MEASUREMENTS:
+                raise ValueError(f"Unknown telemetry measurement: {measurement}")
+            if sink not in TELEMETRY_SINK_TYPES:
+                raise ValueError(f"Invalid telemetry sink for {measurement}: {sink}")
+            if sink != "mqtt" and influx_writer is None:
+                raise ValueError(f"Telemetry sink {sink} for {measurement} requires an InfluxDB writer")
+        self.to_mqtt = {m for m, sink in sinks.items() if sink in ("mqtt", "both")}
+        self.to_influx = {m for m, sink in sinks.items() if sink in ("direct", "both")}
+        self.mqtt_manager.live_only = frozenset(self.to_mqtt & self.to_influx)
+
+    def for_community(self, rec_id: str) -> "TelemetryRouter":
+        """
+        Returns a router for another community sharing the same MQTT connection and InfluxDB writer.
+        """
+        return TelemetryRouter(self.mqtt_manager.for_community(rec_id), self.influx_writer, self.sinks, rec_id,
+                               self.exporter)
+
+    def publish_production(self, *args) -> None:
+        if "production" in self.to_mqtt:
+            self.mqtt_manager.publish_production(*args)
+        if "production" in self.to_influx:
+            self.influx_writer.write(tag_line(LineProtocol.production(*args), self.rec_id))
+        if self.exporter is not None:
+            member_id, prod_id, production, timestamp = args
+            self.exporter.write("production", self.rec_id, timestamp, member_id=member_id, producer_id=prod_id,
+                                value=production)
+
+    def publish_tau_delta(self, *args) -> None:
+        if "tau_delta" in self.to_mqtt:
+            self.mqtt_manager.publish_tau_delta(*args)
+        if "tau_delta" in self.to_influx:
+            self.influx_writer.write(tag_line(LineProtocol.tau_delta(*args), self.rec_id))
+        if self.exporter is not None:
+            cons_id, member_id, tau, delta, cons, activated, timestamp = args
+            self.exporter.write("tau_delta", self.rec_id, timestamp, member_id=member_id, consumer_id=cons_id,
+                                cons=cons, tau=tau, delta=delta, active=activated)
+
+    def publish_battery(self, *args) -> None:
+        if "battery" in self.to_mqtt:
+            self.mqtt_manager.publish_battery(*args)
+        if "battery" in self.to_influx:
+            self.influx_writer.write(tag_line(LineProtocol.battery(*args), self.rec_id))
+        if self.exporter is not None:
+            max_battery, battery_value, battery_consumption, non_battery_consumption, timestamp = args
+            self.exporter.write("battery", self.rec_id, timestamp, max_value=max_battery, value=battery_value,
+                                battery_consumption=battery_consumption,
+                                non_battery_consumption=non_battery_consumption)
+
 class APIManager:
     """
     Handles the API to update tau/delta parameters and activation status.
+    The routes of a community other than the default one are prefixed with /rec/<rec_id>.
     """
-    def __init__(self, sensor: "Sensor") -> None:
-        self.sensor = sensor
+    def __init__(self, sensors: dict) -> None:
+        self.sensors = sensors
         self.app = Bottle()
         self.setup_routes()
+        self.app.mount('/profiling', profiling_app())
 
     def setup_routes(self) -> None:
         @self.app.post('/update_tau_delta')
-        def update_tau_delta():
+        @self.app.post('/rec/<rec_id>/update_tau_delta')
+        def update_tau_delta(rec_id=DEFAULT_REC):
+            sensor = self.sensors.get(rec_id)
+            if sensor is None:
+                return self.unknown_community(rec_id)
             data = request.json
             member_id = data.get('member_id')
             consumer_id = data.get('consumer_id')
             tau = data.get('tau')
             delta = data.get('delta')
-            if member_id in self.sensor.members and consumer_id in self.sensor.members[member_id]["consumers"]:
-                self.sensor.members[member_id]["consumers"][consumer_id]["tau"] = tau
-                self.sensor.members[member_id]["consumers"][consumer_id]["delta"] = delta
-                self.sensor.members[member_id]["consumers"][consumer_id]["activated"] = False
+            if member_id in sensor.members and consumer_id in sensor.members[member_id]["consumers"]:
+                sensor.members[member_id]["consumers"][consumer_id]["tau"] = tau
+                sensor.members[member_id]["consumers"][consumer_id]["delta"] = delta
+                sensor.members[member_id]["consumers"][consumer_id]["activated"] = False
                 response.content_type = 'application/json'
                 return json.dumps({"status": "success"})
             else:
@@ -149,19 +391,67 @@ class APIManager:
                 response.content_type = 'application/json'
                 return json.dumps({"status": "error", "message": "Invalid member_id or consumer_id"})
 
+        @self.app.post('/update_tau_delta/bulk')
+        @self.app.post('/rec/<rec_id>/update_tau_delta/bulk')
+        def update_tau_delta_bulk(rec_id=DEFAULT_REC):
+            """
+            Accepts many tau/delta updates, either as a JSON array or as streamed NDJSON
+            (one update per line). Valid updates are applied together at the next step.
+            """
+            sensor = self.sensors.get(rec_id)
+            if sensor is None:
+                return self.unknown_community(rec_id)
+            if request.content_type.startswith('application/x-ndjson'):
+                items = self.parse_ndjson(request.body)
+            else:
+                try:
+                    items = json.load(request.body)
+                except ValueError as e:
+                    response.status = 400
+                    response.content_type = 'application/json'
+                    return json.dumps({"status": "error", "message": f"Invalid JSON: {e}"})
+                if not isinstance(items, list):
+                    response.status = 400
+                    response.content_type = 'application/json'
+                    return json.dumps({"status": "error", "message": "Expected an array of updates"})
+
+            results = []
+            updates = []
+            for index, item in enumerate(items):
+                error = self.validate_tau_delta(sensor, item)
+                if error is None:
+                    updates.append(((item["member_id"], item["consumer_id"]), item["tau"], item["delta"]))
+                    results.append({"index": index, "status": "accepted"})
+                else:
+                    results.append({"index": index, "status": "error", "message": error})
+            apply_step = sensor.stage_tau_delta(updates)
+
+            response.content_type = 'application/json'
+            return json.dumps({
+                "status": "success" if len(updates) == len(results) else "partial",
+                "accepted": len(updates),
+                "rejected": len(results) - len(updates),
+                "step": apply_step,
+                "results": results
+            })
+
         @self.app.get('/health')
         def health():
             response.content_type = 'application/json'
             return json.dumps({"status": "ok"})
 
         @self.app.get('/activate')
-        def update_activation_status():
+        @self.app.get('/rec/<rec_id>/activate')
+        def update_activation_status(rec_id=DEFAULT_REC):
+            sensor = self.sensors.get(rec_id)
+            if sensor is None:
+                return self.unknown_community(rec_id)
             data = request.json
             member_id = data.get('member_id')
             consumer_id = data.get('consumer_id')
-            print(f"INFO: Activation request received for {member_id}, {consumer_id}", flush=True)
-            if member_id in self.sensor.members and consumer_id in self.sensor.members[member_id]["consumers"]:
-                self.sensor.members[member_id]["consumers"][consumer_id]["activated"] = True
+            print(f"INFO: Activation request received for {member_id}, {consumer_id} of community {rec_id}", flush=True)
+            if member_id in sensor.members and consumer_id in sensor.members[member_id]["consumers"]:
+                sensor.members[member_id]["consumers"][consumer_id]["activated"] = True
                 response.content_type = 'application/json'
                 return json.dumps({"status": "success"})
             else:
@@ -169,19 +459,134 @@ class APIManager:
                 response.content_type = 'application/json'
                 return json.dumps({"status": "error", "message": "Invalid member_id or consumer_id"})
 
+    @staticmethod
+    def unknown_community(rec_id: str) -> str:
+        response.status = 404
+        response.content_type = 'application/json'
+        return json.dumps({"status": "error", "message": f"Unknown community {rec_id}"})
+
+    @staticmethod
+    def parse_ndjson(body) -> list:
+        """
+        Parses an NDJSON body line by line. Malformed lines are kept as None so that
+        they are reported at their position.
+        """
+        items = []
+        for line in body:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+
+    @staticmethod
+    def validate_tau_delta(sensor: "Sensor", item) -> str:
+        """
+        Returns the reason why an update is invalid, or None if it can be applied.
+        """
+        if not isinstance(item, dict):
+            return "Invalid update"
+        member = sensor.members.get(item.get("member_id"))
+        if member is None or item.get("consumer_id") not in member["consumers"]:
+            return "Invalid member_id or consumer_id"
+        for field in ("tau", "delta"):
+            value = item.get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+                return f"Invalid {field}"
+        return None
+
     def run(self) -> None:
-        run(self.app, host="0.0.0.0", port=5000)
+        # Multi-threaded server, so that bulk uploads do not block the other endpoints
+        run(self.app, host="0.0.0.0", port=5000, server="waitress", threads=API_THREADS)
 
 class Sensor:
     """
     Simulates sensor behavior, managing production, tau/delta distribution, and battery level.
     """
-    def __init__(self, publishing_manager: MQTTManager) -> None:
+    def __init__(self, publishing_manager: MQTTManager, config_watcher: ConfigWatcher,
+                 trace: TraceReplay = None, tau_delta_interval_bounds: tuple = TAU_DELTA_INTERVAL_BOUNDS) -> None:
         self.publishing_manager = publishing_manager
-        self.members, self.battery_info = Utils.load_sensor_config()
+        self.trace = trace
+        self.tau_delta_interval_bounds = tau_delta_interval_bounds
+        self.members, self.battery_info = Utils.load_sensor_config(config_watcher.compiled)
+        self.trace_columns = self.map_trace_columns(config_watcher.compiled)
+        # Configuration changes are queued by the watcher thread and applied between steps
+        self.pending_config = queue.Queue()
+        # Bulk tau/delta updates staged by the API and applied together at the next step
+        self.tau_delta_lock = threading.Lock()
+        self.pending_tau_delta = {}
+        config_watcher.add_listener(lambda compiled, delta: self.pending_config.put((compiled, delta)))
         self.battery_value = 0
         self.step_counter = -1
-        self.interval = random.randint(*TAU_DELTA_INTERVAL_BOUNDS)
+        self.simulation_step = 0
+        self.interval = random.randint(*self.tau_delta_interval_bounds)
+
+    def apply_pending_config(self) -> None:
+        """
+        Applies the configuration changes received since the last step.
+        """
+        while not self.pending_config.empty():
+            self.apply_config_delta(*self.pending_config.get())
+
+    def stage_tau_delta(self, updates: list) -> int:
+        """
+        Stages ((member_id, consumer_id), tau, delta) updates for the next step.
+        A later update of the same consumer replaces an earlier one.
+        Returns the step at which the updates will be applied.
+        """
+        with self.tau_delta_lock:
+            for key, tau, delta in updates:
+                self.pending_tau_delta[key] = (tau, delta)
+            return self.simulation_step
+
+    def apply_pending_tau_delta(self) -> None:
+        """
+        Applies all the staged tau/delta updates at once.
+        """
+        with self.tau_delta_lock:
+            pending, self.pending_tau_delta = self.pending_tau_delta, {}
+        for (member_id, consumer_id), (tau, delta) in pending.items():
+            consumer_data = self.members.get(member_id, {}).get("consumers", {}).get(consumer_id)
+            # The consumer may have been removed from the configuration in the meantime
+            if consumer_data is not None:
+                consumer_data["tau"] = tau
+                consumer_data["delta"] = delta
+                consumer_data["activated"] = False
+
+    def apply_config_delta(self, compiled: CompiledREC, delta: ConfigDelta) -> None:
+        """
+        Applies added, removed or changed (max-pi, cons) members and devices without
+        resetting the state (tau, delta, activation, battery level) of the existing ones.
+        """
+        for member_id in delta.added_members:
+            self.members[member_id] = {"producers": {}, "consumers": {}}
+        for member_id, producer_id, max_pi in delta.added_producers:
+            self.members[member_id]["producers"][producer_id] = {
+                "max-pi": max_pi, "idx": compiled.producer_index[(member_id, producer_id)]}
+        for member_id, consumer_id, cons in delta.added_consumers:
+            self.members[member_id]["consumers"][consumer_id] = Utils.new_consumer_state(cons)
+        for member_id, producer_id, _ in delta.removed_producers:
+            self.members.get(member_id, {}).get("producers", {}).pop(producer_id, None)
+        for member_id, consumer_id, _ in delta.removed_consumers:
+            self.members.get(member_id, {}).get("consumers", {}).pop(consumer_id, None)
+        for member_id, producer_id, max_pi in delta.changed_producers:
+            producer_data = self.members.get(member_id, {}).get("producers", {}).get(producer_id)
+            if producer_data is not None:
+                producer_data["max-pi"] = max_pi
+        for member_id, consumer_id, cons in delta.changed_consumers:
+            consumer_data = self.members.get(member_id, {}).get("consumers", {}).get(consumer_id)
+            if consumer_data is not None:
+                consumer_data["cons"] = cons
+        for member_id in delta.removed_members:
+            self.members.pop(member_id, None)
+        if delta.added_producers:
+            self.trace_columns = self.map_trace_columns(compiled)
+        if delta.battery_changed:
+            self.battery_info = dict(compiled.battery)
+            self.battery_value = min(self.battery_value, self.battery_info["max-capacity"])
 
     @staticmethod
     def generate_tau_delta_in_minutes():
@@ -193,99 +598,176 @@ class Sensor:
     def generate_production():
         return random.uniform(0, 1)
 
-    def run(self) -> None:
-        while True:
-            Utils.print_members_in_table(self.members)
-            timestamp = int(time.time() * 1e9)  # timestamp in nanoseconds
-
-            total_production = 0
-            total_consumption = 0
-
-            # Processing each member
-            for member_id, member_data in self.members.items():
-                # Processing producers
-                for producer_id, producer_data in member_data["producers"].items():
-                    average_immediate_production = float(producer_data["max-pi"]) * self.generate_production()
-                    production = average_immediate_production * HOURS_IN_A_SIMULATION_STEP
-                    total_production += production
-                    self.publishing_manager.publish_production(member_id, producer_id, production, timestamp)
-
-                # Processing consumers
-                for consumer_id, consumer_data in member_data["consumers"].items():
-                    if consumer_data["delta"] > 0:
-                        consumer_data["delta"] -= MINUTES_IN_A_SIMULATION_STEP
-                    if consumer_data["activated"]:
-                        consumer_data["tau"] -= MINUTES_IN_A_SIMULATION_STEP
-                        if consumer_data["tau"] <= 0:
-                            consumer_data["activated"] = False
-                            consumer_data["tau"] = 0
-                            consumer_data["delta"] = 0
-                        total_consumption += consumer_data["cons"] * HOURS_IN_A_SIMULATION_STEP
-
-                    self.publishing_manager.publish_tau_delta(
-                        consumer_id,
-                        member_id,
-                        consumer_data["tau"],
-                        consumer_data["delta"],
-                        consumer_data["cons"],
-                        consumer_data["activated"],
-                        timestamp
-                    )
-
-            # Updating the battery value
-            self.battery_value = max(min(self.battery_value + total_production, self.battery_info["max-capacity"]), 0)
-            if total_consumption <= self.battery_value:
-                battery_consumption = total_consumption
-                non_battery_consumption = 0
-                self.battery_value -= total_consumption
-            else:
-                battery_consumption = self.battery_value
-                non_battery_consumption = total_consumption - self.battery_value
-                self.battery_value = 0
-
-            self.publishing_manager.publish_battery(
-                self.battery_info["max-capacity"],
-                self.battery_value,
-                battery_consumption,
-                non_battery_consumption,
-                timestamp
-            )
-
-            # At each interval, generate new tau and delta for a random consumer
-            if self.step_counter == self.interval or self.step_counter == -1:
-                random_member_id = random.choice(list(self.members.keys()))
-                member = self.members[random_member_id]
-                unassigned_consumers = [cid for cid, cdata in member["consumers"].items() if cdata["tau"] == 0 and cdata["delta"] == 0]
-                if unassigned_consumers:
-                    random_consumer_id = random.choice(unassigned_consumers)
-                    tau, delta = self.generate_tau_delta_in_minutes()
-                    self.publishing_manager.publish_tau_delta(
-                        random_consumer_id,
-                        random_member_id,
-                        tau,
-                        delta,
-                        member["consumers"][random_consumer_id]["cons"],
-                        member["consumers"][random_consumer_id]["activated"],
-                        timestamp
-                    )
-                    member["consumers"][random_consumer_id]["tau"] = tau
-                    member["consumers"][random_consumer_id]["delta"] = delta
-                self.step_counter = 0
-                self.interval = random.randint(*TAU_DELTA_INTERVAL_BOUNDS)
-
-            self.step_counter += 1
-            time.sleep(STEP_DURATION)
+    def map_trace_columns(self, compiled: CompiledREC):
+        """
+        Trace column of every producer, indexed by its dense id (None without a trace).
+        """
+        if self.trace is None:
+            return None
+        return self.trace.producer_columns(compiled.producer_index, compiled.producer_slots)
+
+    def trace_fractions(self):
+        """
+        Production fractions of the current step read from the trace, indexed by dense
+        producer id (NaN for the producers the trace does not contain), or None without a trace.
+        """
+        if self.trace is None:
+            return None
+        row = self.trace.row(self.simulation_step)
+        return np.where(self.trace_columns >= 0, row[self.trace_columns], np.nan)
+
+    def production_fraction(self, fractions, producer_data: dict) -> float:
+        """
+        Returns the production of a producer as a fraction of its max-pi, read from
+        the replayed trace when it contains the producer and generated randomly otherwise.
+        """
+        if fractions is not None:
+            fraction = fractions[producer_data["idx"]]
+            if not np.isnan(fraction):
+                return float(fraction)
+        return self.generate_production()
+
+    @hot_path
+    def step(self, timestamp: int) -> dict:
+        """
+        Advances the simulation by one step: production, consumers' tau/delta,
+        battery level and tau/delta generation. Returns the energy totals of the step.
+        """
+        total_production = 0
+        total_consumption = 0
+        fractions = self.trace_fractions()
+
+        # Processing each member
+        for member_id, member_data in self.members.items():
+            # Processing producers
+            for producer_id, producer_data in member_data["producers"].items():
+                average_immediate_production = float(producer_data["max-pi"]) * self.production_fraction(fractions, producer_data)
+                production = average_immediate_production * HOURS_IN_A_SIMULATION_STEP
+                total_production += production
+                self.publishing_manager.publish_production(member_id, producer_id, production, timestamp)
+
+            # Processing consumers
+            for consumer_id, consumer_data in member_data["consumers"].items():
+                if consumer_data["delta"] > 0:
+                    consumer_data["delta"] -= MINUTES_IN_A_SIMULATION_STEP
+                if consumer_data["activated"]:
+                    consumer_data["tau"] -= MINUTES_IN_A_SIMULATION_STEP
+                    if consumer_data["tau"] <= 0:
+                        consumer_data["activated"] = False
+                        consumer_data["tau"] = 0
+                        consumer_data["delta"] = 0
+                    total_consumption += consumer_data["cons"] * HOURS_IN_A_SIMULATION_STEP
+
+                self.publishing_manager.publish_tau_delta(
+                    consumer_id,
+                    member_id,
+                    consumer_data["tau"],
+                    consumer_data["delta"],
+                    consumer_data["cons"],
+                    consumer_data["activated"],
+                    timestamp
+                )
+
+        # Updating the battery value
+        curtailed = max(self.battery_value + total_production - self.battery_info["max-capacity"], 0)
+        self.battery_value = max(min(self.battery_value + total_production, self.battery_info["max-capacity"]), 0)
+        if total_consumption <= self.battery_value:
+            battery_consumption = total_consumption
+            non_battery_consumption = 0
+            self.battery_value -= total_consumption
+        else:
+            battery_consumption = self.battery_value
+            non_battery_consumption = total_consumption - self.battery_value
+            self.battery_value = 0
+
+        self.publishing_manager.publish_battery(
+            self.battery_info["max-capacity"],
+            self.battery_value,
+            battery_consumption,
+            non_battery_consumption,
+            timestamp
+        )
+
+        # At each interval, generate new tau and delta for a random consumer
+        if self.step_counter == self.interval or self.step_counter == -1:
+            random_member_id = random.choice(list(self.members.keys()))
+            member = self.members[random_member_id]
+            unassigned_consumers = [cid for cid, cdata in member["consumers"].items() if cdata["tau"] == 0 and cdata["delta"] == 0]
+            if unassigned_consumers:
+                random_consumer_id = random.choice(unassigned_consumers)
+                tau, delta = self.generate_tau_delta_in_minutes()
+                self.publishing_manager.publish_tau_delta(
+                    random_consumer_id,
+                    random_member_id,
+                    tau,
+                    delta,
+                    member["consumers"][random_consumer_id]["cons"],
+                    member["consumers"][random_consumer_id]["activated"],
+                    timestamp
+                )
+                member["consumers"][random_consumer_id]["tau"] = tau
+                member["consumers"][random_consumer_id]["delta"] = delta
+            self.step_counter = 0
+            self.interval = random.randint(*self.tau_delta_interval_bounds)
+
+        self.step_counter += 1
+        self.simulation_step += 1
+
+        return {
+            "production": total_production,
+            "consumption": total_consumption,
+            "curtailed": curtailed,
+            "battery_consumption": battery_consumption,
+            "non_battery_consumption": non_battery_consumption,
+            "battery": self.battery_value
+        }
+
+    def tick(self, timestamp: int) -> dict:
+        """
+        Applies the pending changes and advances the simulation by one step.
+        """
+        self.apply_pending_config()
+        self.apply_pending_tau_delta()
+        return self.step(timestamp)
+
+def run_communities(sensors: dict, scheduler: FairScheduler) -> None:
+    """
+    Steps every community at each STEP_DURATION on the shared worker pool.
+    A community still busy with its previous step skips the current one.
+    """
+    while True:
+        started = time.time()
+        timestamp = int(started * 1e9)  # timestamp in nanoseconds
+        if len(sensors) == 1:
+            Utils.print_members_in_table(next(iter(sensors.values())).members)
+        scheduler.submit_round({rec_id: (lambda sensor=sensor: sensor.tick(timestamp))
+                                for rec_id, sensor in sensors.items()})
+        time.sleep(max(STEP_DURATION - (time.time() - started), 0))
 
 # Main code
 if __name__ == '__main__':
-    publishing_manager = MQTTManager(BROKER, PORT, PROD_TOPIC_STRUCTURE, TAUDELTA_TOPIC_STRUCTURE, BATTERY_TOPIC_STRUCTURE)
-    sensor = Sensor(publishing_manager)
+    mqtt_manager = MQTTManager(BROKER, PORT, PROD_TOPIC_STRUCTURE, TAUDELTA_TOPIC_STRUCTURE, BATTERY_TOPIC_STRUCTURE)
+    influx_writer = None
+    if any(sink != "mqtt" for sink in TELEMETRY_SINKS.values()):
+        influx_writer = InfluxWriter(INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET)
+        atexit.register(influx_writer.close)
+    publishing_manager = TelemetryRouter(mqtt_manager, influx_writer, TELEMETRY_SINKS,
+                                         exporter=create_exporter(EXPORT_SCHEMAS))
+    trace = TraceReplay(PRODUCTION_TRACE, step_seconds=SECONDS_IN_A_SIMULATION_STEP) if PRODUCTION_TRACE else None
+
+    # One isolated sensor state per community, all publishing over the same connections
+    sensors = {}
+    for rec_id, config_path in discover_communities().items():
+        config_watcher = ConfigWatcher(config_path)
+        sensors[rec_id] = Sensor(publishing_manager.for_community(rec_id), config_watcher, trace)
+        config_watcher.start()
+    print(f"INFO: Simulating {len(sensors)} communities: {', '.join(sensors)}", flush=True)
 
     # Start API server in a separate thread
-    api_manager = APIManager(sensor)
+    api_manager = APIManager(sensors)
     api_thread = threading.Thread(target=api_manager.run)
     api_thread.daemon = True
     api_thread.start()
 
     # Start sensor simulation
-    sensor.run()
+    run_communities(sensors, FairScheduler())
@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [PROJECT_DIR, os.path.join(PROJECT_DIR, "sensors")]
+
+from sensors import APIManager, parse_telemetry_sinks
+
+
+class ValidateTauDeltaTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sensor = SimpleNamespace(members={"member1": {"consumers": {"consumer1": {}}}})
+
+    def update(self, **fields) -> dict:
+        return {"member_id": "member1", "consumer_id": "consumer1", "tau": 10, "delta": 5.5, **fields}
+
+    def test_valid_update(self):
+        self.assertIsNone(APIManager.validate_tau_delta(self.sensor, self.update()))
+
+    def test_unknown_consumer(self):
+        self.assertEqual(APIManager.validate_tau_delta(self.sensor, self.update(consumer_id="consumer2")),
+                         "Invalid member_id or consumer_id")
+
+    def test_invalid_values(self):
+        for field in ("tau", "delta"):
+            for value in (-1, "10", True, None, float("nan"), float("inf"), float("-inf")):
+                with self.subTest(field=field, value=value):
+                    self.assertEqual(APIManager.validate_tau_delta(self.sensor, self.update(**{field: value})),
+                                     f"Invalid {field}")
+
+
+class ParseTelemetrySinksTest(unittest.TestCase):
+    def test_missing_measurements_go_to_mqtt(self):
+        self.assertEqual(parse_telemetry_sinks("battery=direct"),
+                         {"production": "mqtt", "tau_delta": "mqtt", "battery": "direct"})
+        self.assertEqual(parse_telemetry_sinks(""), {"production": "mqtt", "tau_delta": "mqtt", "battery": "mqtt"})
+
+    def test_invalid_entries(self):
+        for value in ("taudelta=direct", "production=", "production", "production=influx", "=mqtt"):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parse_telemetry_sinks(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
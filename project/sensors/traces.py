@@ -0,0 +1,194 @@
+import argparse
+import json
+import math
+import os
+from typing import Dict, List, Optional
+import numpy as np
+
+# A trace is stored as two files:
+#   <name>.npy            float32 matrix of shape (steps, producers), values in [0, 1]
+#                         (fraction of the producer max-pi), memory-mapped when replayed
+#   <name>.producers.json {"step_seconds": <seconds per row>, "producers": column layout as a
+#                         list of "member_id/producer_id" keys}
+TRACE_DTYPE = np.float32
+SECONDS_IN_A_DAY = 24 * 3600
+
+
+def producers_path(trace_path: str) -> str:
+    return os.path.splitext(trace_path)[0] + ".producers.json"
+
+
+def producer_key(member_id: str, producer_id: str) -> str:
+    return f"{member_id}/{producer_id}"
+
+
+class TraceReplay:
+    """
+    Replays per-producer production fractions from a memory-mapped trace.
+    Rows are indexed by simulation step and columns by producer; reading a step
+    returns a view on the mapped file, so no data is copied.
+    When step_seconds is given, the trace must have been recorded at that resolution.
+    """
+    def __init__(self, path: str, loop: bool = True, step_seconds: int = None) -> None:
+        self.path = path
+        self.loop = loop
+        self.data = np.load(path, mmap_mode='r')
+        if self.data.ndim != 2:
+            raise ValueError(f"Trace {path} must be a 2D (steps x producers) matrix")
+        with open(producers_path(path), 'r') as file:
+            layout = json.load(file)
+        if isinstance(layout, list):
+            # Layout written before the step length was recorded
+            keys, self.step_seconds = layout, None
+            print(f"WARNING: Trace {path} does not record its step length, it cannot be validated", flush=True)
+        else:
+            keys, self.step_seconds = layout["producers"], layout["step_seconds"]
+        if step_seconds is not None and self.step_seconds is not None and self.step_seconds != step_seconds:
+            raise ValueError(f"Trace {path} has steps of {self.step_seconds}s but the simulation steps "
+                             f"last {step_seconds}s")
+        if len(keys) != self.data.shape[1]:
+            raise ValueError(f"Trace {path} has {self.data.shape[1]} columns but {len(keys)} producers")
+        self.columns: Dict[str, int] = {key: idx for idx, key in enumerate(keys)}
+        print(f"INFO: Loaded production trace {path} with {self.steps} steps and {len(keys)} producers", flush=True)
+
+    @property
+    def steps(self) -> int:
+        return self.data.shape[0]
+
+    def column(self, member_id: str, producer_id: str) -> Optional[int]:
+        """
+        Returns the column of a producer, or None if the trace does not contain it.
+        """
+        return self.columns.get(producer_key(member_id, producer_id))
+
+    def producer_columns(self, producer_index: Dict[tuple, int], slots: int) -> np.ndarray:
+        """
+        Maps the dense producer ids of a compiled configuration to trace columns
+        (-1 for the producers the trace does not contain).
+        """
+        columns = np.full(slots, -1, dtype=np.int64)
+        for (member_id, producer_id), idx in producer_index.items():
+            column = self.column(member_id, producer_id)
+            if column is not None:
+                columns[idx] = column
+        return columns
+
+    def row(self, step: int) -> np.ndarray:
+        """
+        Returns the production fractions of every producer at the given step (zero-copy view).
+        """
+        if self.loop:
+            step %= self.steps
+        elif step >= self.steps:
+            raise IndexError(f"Step {step} is beyond the end of the trace ({self.steps} steps)")
+        return self.data[step]
+
+
+def solar_clear_sky(seconds: np.ndarray, day_of_year_start: int) -> np.ndarray:
+    """
+    Clear-sky solar profile in [0, 1] for the given offsets in seconds.
+    Daylight length follows the season (about 9h in winter, 15h in summer).
+    """
+    day = day_of_year_start + seconds / SECONDS_IN_A_DAY
+    hour = (seconds % SECONDS_IN_A_DAY) / 3600
+    day_length = 12 - 3 * np.cos(2 * math.pi * (day + 10) / 365)
+    sunrise = 12 - day_length / 2
+    # Sun elevation proxy: half sine wave between sunrise and sunset
+    phase = np.clip((hour - sunrise) / day_length, 0, 1)
+    seasonal_peak = 0.75 + 0.25 * -np.cos(2 * math.pi * (day + 10) / 365)
+    return np.sin(math.pi * phase) * seasonal_peak
+
+
+def wind_power_curve(speed: np.ndarray, cut_in: float = 3, rated: float = 12, cut_out: float = 25) -> np.ndarray:
+    """
+    Normalized turbine power curve: cubic between cut-in and rated speed, zero above cut-out.
+    """
+    power = np.clip((speed ** 3 - cut_in ** 3) / (rated ** 3 - cut_in ** 3), 0, 1)
+    power[speed >= cut_out] = 0
+    return power
+
+
+def generate_traces(path: str, keys: List[str], steps: int, step_seconds: int,
+                    wind_share: float = 0.3, day_of_year_start: int = 172,
+                    seed: int = 0, chunk_steps: int = 4096) -> None:
+    """
+    Writes synthetic solar/wind production traces for the given producer keys.
+    Solar producers follow a seasonal clear-sky curve attenuated by a persistent
+    cloudiness process; wind producers follow a mean-reverting wind speed through
+    a power curve. Rows are generated in chunks straight into the memory-mapped file.
+    """
+    rng = np.random.default_rng(seed)
+    producers = len(keys)
+    is_wind = rng.random(producers) < wind_share
+    # Per-producer site factors: panel efficiency / turbine site quality
+    site_factor = rng.uniform(0.8, 1.0, producers).astype(TRACE_DTYPE)
+    mean_wind = rng.uniform(5, 9, producers)
+
+    # AR(1) coefficients, with a correlation time of ~3h for clouds and ~6h for wind
+    cloud_phi = math.exp(-step_seconds / (3 * 3600))
+    wind_phi = math.exp(-step_seconds / (6 * 3600))
+    cloud_state = rng.standard_normal(producers)
+    wind_state = rng.standard_normal(producers)
+    # Regional weather shared by all producers, so that sites are correlated
+    regional_cloud = rng.standard_normal()
+    regional_wind = rng.standard_normal()
+
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=TRACE_DTYPE, shape=(steps, producers))
+    for start in range(0, steps, chunk_steps):
+        stop = min(start + chunk_steps, steps)
+        seconds = np.arange(start, stop) * step_seconds
+        clear_sky = solar_clear_sky(seconds, day_of_year_start)
+        for offset in range(stop - start):
+            regional_cloud = cloud_phi * regional_cloud + math.sqrt(1 - cloud_phi ** 2) * rng.standard_normal()
+            regional_wind = wind_phi * regional_wind + math.sqrt(1 - wind_phi ** 2) * rng.standard_normal()
+            cloud_state = cloud_phi * cloud_state + math.sqrt(1 - cloud_phi ** 2) * rng.standard_normal(producers)
+            wind_state = wind_phi * wind_state + math.sqrt(1 - wind_phi ** 2) * rng.standard_normal(producers)
+
+            # Cloud cover in [0, 1] from the combined regional and local process
+            cover = 1 / (1 + np.exp(-(0.7 * regional_cloud + 0.3 * cloud_state) * 1.5))
+            solar = clear_sky[offset] * (1 - 0.75 * cover)
+            speed = np.maximum(mean_wind * (1 + 0.45 * (0.6 * regional_wind + 0.4 * wind_state)), 0)
+            wind = wind_power_curve(speed)
+
+            out[start + offset] = np.where(is_wind, wind, solar) * site_factor
+        out.flush()
+    del out
+
+    with open(producers_path(path), 'w') as file:
+        json.dump({"step_seconds": step_seconds, "producers": keys}, file)
+
+
+def keys_from_rec(config_path: str) -> List[str]:
+    """
+    Returns the producer keys of a REC.json file in a stable order.
+    """
+    with open(config_path, 'r') as file:
+        config = json.load(file)
+    return [producer_key(member_id, producer_id)
+            for member_id, member_data in config["members"].items()
+            for producer_id in member_data["producers"]]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate synthetic solar/wind production traces.")
+    parser.add_argument("--out", required=True, help="Output .npy file")
+    parser.add_argument("--config", default="config/REC.json", help="REC.json providing the producers")
+    parser.add_argument("--producers", type=int, default=None,
+                        help="Generate this many synthetic producers instead of reading --config")
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--step-seconds", type=int, default=60)
+    parser.add_argument("--wind-share", type=float, default=0.3)
+    parser.add_argument("--start-day", type=int, default=172, help="Day of the year of the first step")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.producers is not None:
+        keys = [producer_key(f"m{i // 10}", f"p{i % 10}") for i in range(args.producers)]
+    else:
+        keys = keys_from_rec(args.config)
+    steps = int(args.days * SECONDS_IN_A_DAY / args.step_seconds)
+    generate_traces(args.out, keys, steps, args.step_seconds, args.wind_share, args.start_day, args.seed)
+    print(f"INFO: Wrote {steps} steps for {len(keys)} producers to {args.out}", flush=True)